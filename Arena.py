@@ -1,9 +1,65 @@
+import logging
 import math
+import multiprocessing
 
+import numpy as np
 from tqdm import tqdm
 
+from MCTS import MCTS
+
 tqdm.monitor_interval = 0
 
+log = logging.getLogger(__name__)
+
+_arena_worker = None  # game, the two networks and args of a ParallelArena process
+
+
+def isTie(result):
+    """A win scores at least a point; smaller results (curling returns 1e-5) are ties."""
+    return abs(result) < 1
+
+
+def _initArenaWorker(game, nnet_class, args, checkpoint1, checkpoint2):
+    global _arena_worker
+    nnets = []
+    for checkpoint in (checkpoint1, checkpoint2):
+        nnet = nnet_class(game)
+        nnet.load_checkpoint(*checkpoint)
+        nnets.append(nnet)
+    _arena_worker = game, nnets, args
+
+
+def _playArenaGame(task):
+    """
+    One game with new search trees for both sides, from task (swapped, opening).
+    Seeded so the same task always plays the same game. Returns Arena.playGame's result.
+    """
+    swapped, opening = task
+    game, nnets, args = _arena_worker
+    rng = np.random.default_rng(0)  # MCTS breaks ties at random
+    mcts1, mcts2 = (MCTS(game, nnet, args) for nnet in nnets)
+    player1 = lambda x: np.argmax(mcts1.getActionProb(x, temp=0, rng=rng))
+    player2 = lambda x: np.argmax(mcts2.getActionProb(x, temp=0, rng=rng))
+    if swapped:
+        player1, player2 = player2, player1
+    return Arena(player1, player2, game).playGame(opening=opening)
+
+
+def randomOpenings(game, num, moves, seed=None):
+    """num openings of `moves` random valid actions each. The same seed gives the same openings."""
+    rng = np.random.default_rng(seed)
+    openings = []
+    for _ in range(num):
+        board, player = game.getInitBoard(), 1
+        opening = []
+        for _ in range(moves):
+            valids = game.getValidMoves(game.getCanonicalForm(board, player), 1)
+            action = int(rng.choice(np.flatnonzero(valids)))
+            opening.append(action)
+            board, player = game.getNextState(board, player, action)
+        openings.append(tuple(opening))
+    return openings
+
 
 class Arena():
     """
@@ -27,9 +83,10 @@ class Arena():
         self.game = game
         self.display = display
 
-    def playGame(self, verbose=False):
+    def playGame(self, verbose=False, opening=()):
         """
-        Executes one episode of a game.
+        Executes one episode of a game. The actions in opening are played
+        first, by whoever's turn it is.
 
         Returns:
             either
@@ -43,6 +100,9 @@ class Arena():
         total_moves = 16  # Curling
         progressbar = tqdm(total=total_moves, disable=verbose, ncols=100)  # Don't want a bar when pitting
         it = 0
+        for action in opening:
+            board, curPlayer = self.game.getNextState(board, curPlayer, action)
+            progressbar.update()
         end_score = self.game.getGameEnded(board, curPlayer)
         while end_score == 0:
             it += 1
@@ -71,15 +131,23 @@ class Arena():
             self.display(board)
         return curPlayer * end_score
 
-    def playGames(self, num, verbose=False):
+    def playGames(self, num, verbose=False, sprt=None):
         """
         Plays num games in which player1 starts num/2 games and player2 starts
         num/2 games.
 
+        With an SPRT, the players take turns starting instead and play stops
+        after the first pair of games the test is decided on. num is then
+        the most games played.
+
         Returns:
             oneWon: games won by player1
             twoWon: games won by player2
         """
+        if sprt is not None:
+            return self._playGamesSequential(num, verbose, sprt)
+
+        self.gamesPlayed = num
         p1_score = 0
         p2_score = 0
         for _ in tqdm(range(math.ceil(num / 2)), desc="Arena.playGames p1/p2", ncols=100):
@@ -103,3 +171,147 @@ class Arena():
                 p1_score -= res
 
         return p1_score, p2_score
+
+    def _playGamesSequential(self, num, verbose, sprt):
+        player1, player2 = self.player1, self.player2
+        p1_score = 0
+        p2_score = 0
+        self.gamesPlayed = 0
+        for i in tqdm(range(num), desc="Arena.playGames", ncols=100):
+            swapped = i % 2 == 1
+            self.player1, self.player2 = (player2, player1) if swapped else (player1, player2)
+            res = self.playGame(verbose=verbose)
+            if res == 0:
+                raise Exception('WHOA playGame ended before end of game.')
+            p1_won = (res > 0) != swapped
+            if p1_won:
+                p1_score += abs(res)
+            else:
+                p2_score += abs(res)
+            if not isTie(res):  # the SPRT only counts decided games
+                sprt.update(not p1_won)
+            self.gamesPlayed += 1
+            if swapped and sprt.decision() is not None:
+                break
+
+        self.player1, self.player2 = player1, player2
+        return p1_score, p2_score
+
+
+class SPRT():
+    """
+    Sequential probability ratio test on the games won by player2 (the new
+    network). It tests a win rate of threshold - margin (reject) against
+    threshold + margin (accept), with error rates alpha and beta.
+    """
+
+    def __init__(self, threshold, margin=0.2, alpha=0.05, beta=0.05):
+        p0 = max(threshold - margin, 1e-3)
+        p1 = min(threshold + margin, 1 - 1e-3)
+        self.win = math.log(p1 / p0)
+        self.loss = math.log((1 - p1) / (1 - p0))
+        self.upper = math.log((1 - beta) / alpha)
+        self.lower = math.log(beta / (1 - alpha))
+        self.llr = 0.0  # log likelihood ratio so far
+
+    def update(self, won):
+        self.llr += self.win if won else self.loss
+
+    def decision(self):
+        """True to accept player2, False to reject it, None while undecided."""
+        if self.llr >= self.upper:
+            return True
+        if self.llr <= self.lower:
+            return False
+        return None
+
+
+class ParallelArena():
+    """
+    Plays Arena games between two checkpoints on a pool of processes. Every
+    process loads both networks from their checkpoint files once and plays
+    each game with new MCTS trees (args are the MCTS args).
+
+    With temp=0 searches and deterministic physics a game only depends on who
+    starts and on its opening, so each pair of games gets its own random
+    opening, played once with each side starting. Games that would replay an
+    earlier one are not played again, and they don't count in the scores or
+    the SPRT: a replay is no new evidence.
+    """
+
+    def __init__(self, game, nnet_class, args, checkpoint1, checkpoint2, workers, opening_moves=0, seed=None):
+        """
+        Input:
+            checkpoint 1,2: (folder, filename) of the networks playing as
+                            player 1 and player 2
+            workers: number of processes
+            opening_moves: random actions played before the networks take
+                           over. 0 plays every game from the initial board.
+            seed: seed of the openings
+        """
+        self.game = game
+        self.nnet_class = nnet_class
+        self.args = args
+        self.checkpoint1 = checkpoint1
+        self.checkpoint2 = checkpoint2
+        self.workers = workers
+        self.opening_moves = opening_moves
+        self.seed = seed
+        self.results = []  # (swapped, playGame result) of every game, in order, replays included
+        self.gamesPlayed = 0
+        self.replays = 0  # games in results that repeat an identical earlier game, not scored
+
+    def playGames(self, num, sprt=None):
+        """
+        Same as Arena.playGames: player1 starts num/2 games and player2
+        starts num/2 games, or with an SPRT, they take turns and play stops
+        once the test is decided. Games still running then are dropped.
+
+        Returns:
+            oneWon: games won by player1
+            twoWon: games won by player2
+        """
+        pairs = math.ceil(num / 2)
+        if self.opening_moves:
+            openings = randomOpenings(self.game, pairs, self.opening_moves, self.seed)
+        else:
+            openings = [()] * pairs
+        if sprt is None:
+            tasks = [(False, opening) for opening in openings] + [(True, opening) for opening in openings[:num // 2]]
+        else:
+            tasks = [(i % 2 == 1, openings[i // 2]) for i in range(num)]
+
+        p1_score = 0
+        p2_score = 0
+        self.results = []
+        self.replays = 0
+        played = {}
+        initargs = (self.game, self.nnet_class, self.args, self.checkpoint1, self.checkpoint2)
+        with multiprocessing.get_context('spawn').Pool(self.workers, _initArenaWorker, initargs) as pool:
+            # New tasks come up in the same order in tasks as in the deduplicated list.
+            results = pool.imap(_playArenaGame, list(dict.fromkeys(tasks)))
+            for task in tqdm(tasks, desc="Arena.playGames", ncols=100):
+                if task in played:
+                    self.replays += 1
+                    self.results.append((task[0], played[task]))
+                    continue
+                played[task] = next(results)
+                swapped, res = task[0], played[task]
+                if res == 0:
+                    raise Exception('WHOA playGame ended before end of game.')
+                self.results.append((swapped, res))
+                p1_won = (res > 0) != swapped
+                if p1_won:
+                    p1_score += abs(res)
+                else:
+                    p2_score += abs(res)
+                if sprt is not None:
+                    if not isTie(res):  # the SPRT only counts decided games
+                        sprt.update(not p1_won)
+                    if swapped and sprt.decision() is not None:
+                        break
+        self.gamesPlayed = len(self.results)
+        if self.replays:
+            log.info('Arena skipped %s of %s games that would replay an earlier one',
+                     self.replays, self.gamesPlayed)
+        return p1_score, p2_score
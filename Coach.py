@@ -1,28 +1,89 @@
+import concurrent.futures
+import contextlib
+import json
 import logging
+import multiprocessing
 import os
-import random
+import queue
+import shutil
 import sys
+import threading
 import time
+import uuid
 from collections import deque
 from datetime import datetime
-from pickle import Pickler, Unpickler
+from pickle import Unpickler
 
 import numpy as np
 from tqdm import tqdm
 
-from Arena import Arena
+from Arena import Arena, ParallelArena, SPRT
+from InferenceServer import InferenceClient, InferenceServer
 from MCTS import MCTS
+from ReplayBuffer import ReplayBuffer
 
 log = logging.getLogger(__name__)
 
 tqdm.monitor_interval = 0
 
+_CHUNK_PARTS = ('boards', 'pis', 'vs')  # one .npy file each in an example chunk
+_WORKER_CHECK = 1.0  # seconds learnAsync waits for a game between checks that no self-play worker died
+
+
+class SelfPlayException(Exception):
+    """A self-play worker stopped before finishing its game."""
+
 
 def get_hour():
     now = time.time()
     return datetime.fromtimestamp(now).hour
 
 
+_worker_coach = None  # Coach of a self-play worker process
+
+
+def _initSelfPlayWorker(game, nnet_class, checkpoint, args, clients=None, claimed=None):
+    """
+    Runs once in every self-play worker. The worker gets its own game, network and Coach. With an inference server
+    the network is the next unclaimed client of the server instead.
+    """
+    global _worker_coach
+    if clients is None:
+        nnet = nnet_class(game)
+        nnet.load_checkpoint(*checkpoint)
+    else:
+        with claimed.get_lock():
+            nnet = clients[claimed.value]
+            claimed.value += 1
+    _worker_coach = Coach(game, nnet, args)
+
+
+def _poolWorkers(pool):
+    """Process ids of a Pool's workers. The pool replaces a worker that dies, and the task it was running is lost."""
+    return {process.pid for process in pool._pool}
+
+
+def _playSelfPlayEpisode(seed):
+    return _worker_coach.playEpisode(seed)
+
+
+_worker_version = 0  # number of the best network a self-play worker has loaded
+
+
+def _playAsyncEpisode(seed, checkpoint, version):
+    """
+    Self-play episode for learnAsync. Loads the best network from checkpoint first if it's newer than the one the
+    worker has. Returns playEpisode's result and the seconds it took.
+    """
+    global _worker_version
+    if version != _worker_version:
+        if not isinstance(_worker_coach.nnet, InferenceClient):  # The server loads new weights for its clients.
+            _worker_coach.nnet.load_checkpoint(*checkpoint)
+        _worker_version = version
+    start = time.time()
+    return _worker_coach.playEpisode(seed), time.time() - start
+
+
 class Coach():
     """
     This class executes the self-play + learning. It uses the functions defined
@@ -32,13 +93,18 @@ class Coach():
     def __init__(self, game, nnet, args):
         self.game = game
         self.nnet = nnet
-        self.pnet = self.nnet.__class__(self.game)  # the competitor network
+        self.pnet = None  # the competitor network, built by learn() for the serial arena
         self.args = args
         self.mcts = MCTS(self.game, self.nnet, self.args)
-        self.trainExamplesHistory = []  # history of examples from args.numItersForTrainExamplesHistory latest iterations
+        # examples from the args.numItersForTrainExamplesHistory latest iterations, at most maxlenOfQueue each
+        self.trainExamplesHistory = ReplayBuffer(
+            self.game.getBoardSize(), self.game.getActionSize(),
+            self.args.maxlenOfQueue * self.args.numItersForTrainExamplesHistory)
+        self.exampleChunks = []  # manifest entries of the chunks holding the iterations in trainExamplesHistory
+        self.seeds = np.random.SeedSequence(self.args.seed)  # one child stream per self-play episode
         self.skipFirstSelfPlay = False  # can be overriden in loadTrainExamples()
 
-    def executeEpisode(self):
+    def executeEpisode(self, seed=None):
         """
         This function executes one episode of self-play, starting with player 1.
         As the game is played, each turn is added as a training example to
@@ -47,13 +113,15 @@ class Coach():
         in train_examples.
 
         It uses a temp=1 if episodeStep < tempThreshold, and thereafter
-        uses temp=0.
+        uses temp=0. If seed (a np.random.SeedSequence) is given, the episode
+        draws its random numbers from a generator of its own seeded with it.
 
         Returns:
             train_examples: a list of examples of the form (canonicalBoard,pi,v)
                            pi is the MCTS informed policy vector, v is +1 if
                            the player eventually won the game, else -1.
         """
+        rng = np.random.default_rng(seed)
         train_examples = []
         board = self.game.getInitBoard()
         player = 1
@@ -65,20 +133,233 @@ class Coach():
             canonicalBoard = self.game.getCanonicalForm(board, player)
             temp = int(episode_step < self.args.tempThreshold)
 
-            pi = self.mcts.getActionProb(canonicalBoard, temp=temp)
-            sym = self.game.getSymmetries(canonicalBoard, pi)
-            for b, p in sym:
-                train_examples.append([b, player, p, None])
+            pi = self.mcts.getActionProb(canonicalBoard, temp=temp, rng=rng)
+            # Symmetrical forms are drawn at train time (game.getRandomSymmetries).
+            train_examples.append([canonicalBoard, player, pi, None])
 
-            np.random.seed(int(time.time()))
-            action = np.random.choice(len(pi), p=pi)
+            action = rng.choice(len(pi), p=pi)
             board, player = self.game.getNextState(board, player, action)
 
             result = self.game.getGameEnded(board, player)
+            if result == 0:
+                # The next search starts from the subtree already built under this move.
+                self.mcts.prune(self.game.getCanonicalForm(board, player))
 
         assert result != 0
         return [(x[0], x[2], result * ((-1) ** (x[1] != player))) for x in train_examples]
 
+    def playEpisode(self, seed=None):
+        """executeEpisode with a new search tree. Returns the examples and the MCTS transposition counts."""
+        self.mcts = MCTS(self.game, self.nnet, self.args)  # reset search tree
+        examples = self.executeEpisode(seed)
+        return examples, len(self.mcts.Rs), self.mcts.merged
+
+    def selfPlay(self):
+        """
+        Plays numEps episodes of self-play, on numSelfPlayWorkers processes
+        if more than one. Every episode has its own random stream, spawned
+        from args.seed.
+
+        Returns:
+            examples: a deque with the examples of all episodes, at most
+                      maxlenOfQueue long
+            searched, merged: MCTS transposition counts, summed over episodes
+        """
+        examples = deque([], maxlen=self.args.maxlenOfQueue)
+        seeds = self.seeds.spawn(self.args.numEps)
+        workers = min(self.args.numSelfPlayWorkers or 1, self.args.numEps)
+        searched, merged = 0, 0
+
+        if workers == 1:
+            for seed in tqdm(seeds, desc="Self Play", ncols=100):
+                episode, episode_searched, episode_merged = self.playEpisode(seed)
+                examples += episode
+                searched, merged = searched + episode_searched, merged + episode_merged
+            return examples, searched, merged
+
+        # Workers (or the inference server) load the current weights from disk.
+        self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='selfplay.pth.tar')
+        checkpoint = (self.args.checkpoint, 'selfplay.pth.tar')
+        context = multiprocessing.get_context('spawn')
+        with contextlib.ExitStack() as stack:
+            initargs = (self.game, self.nnet.__class__, checkpoint, self.args)
+            if self.args.inferenceServer:
+                server = stack.enter_context(InferenceServer(
+                    self.game, self.nnet.__class__, checkpoint, clients=workers,
+                    max_boards=self.args.mctsBatchSize or 1, max_batch_size=self.args.inferenceMaxBatch or 64,
+                    max_wait=self.args.inferenceMaxWait or 0.002, threads=self.args.inferenceThreads))
+                initargs += (server.clients, context.Value('i', 0))
+            pool = stack.enter_context(context.Pool(workers, _initSelfPlayWorker, initargs))
+
+            # Examples come back as soon as each game finishes.
+            episodes = pool.imap_unordered(_playSelfPlayEpisode, seeds)
+            for episode, episode_searched, episode_merged in tqdm(episodes, total=len(seeds), desc="Self Play",
+                                                                  ncols=100):
+                examples += episode
+                searched, merged = searched + episode_searched, merged + episode_merged
+        return examples, searched, merged
+
+    def learnAsync(self):
+        """
+        learn() with the stages running at the same time: numSelfPlayWorkers
+        processes keep playing games with the best network, while this
+        process trains on every numEps new games and an arena process pits
+        each new checkpoint against the best one. An accepted network is
+        loaded by self-play workers before their next game. Checkpoints that
+        appear while an arena is still playing skip gating. The arena plays
+        on numArenaWorkers processes of its own.
+        """
+        workers = self.args.numSelfPlayWorkers or 1
+        folder = self.args.checkpoint
+        self.nnet.save_checkpoint(folder=folder, filename='selfplay.pth.tar')
+        context = multiprocessing.get_context('spawn')
+        finished = queue.Queue()
+        busy = {'self play': 0.0, 'training': 0.0, 'arena': 0.0}  # seconds
+        start = time.time()
+
+        with contextlib.ExitStack() as stack:
+            initargs = (self.game, self.nnet.__class__, (folder, 'selfplay.pth.tar'), self.args)
+            server = None
+            if self.args.inferenceServer:
+                server = stack.enter_context(InferenceServer(
+                    self.game, self.nnet.__class__, (folder, 'selfplay.pth.tar'), clients=workers,
+                    max_boards=self.args.mctsBatchSize or 1, max_batch_size=self.args.inferenceMaxBatch or 64,
+                    max_wait=self.args.inferenceMaxWait or 0.002, threads=self.args.inferenceThreads))
+                initargs += (server.clients, context.Value('i', 0))
+            pool = stack.enter_context(context.Pool(workers, _initSelfPlayWorker, initargs))
+            arena_thread = stack.enter_context(concurrent.futures.ThreadPoolExecutor(1))
+
+            # Workers go straight to their next game from the result thread, even while this one is training.
+            best = {'checkpoint': (folder, 'selfplay.pth.tar'), 'version': 0}
+            lock = threading.Lock()
+            stopping = threading.Event()
+
+            def playNext(*_):
+                if stopping.is_set():
+                    return
+                with lock:
+                    seed = self.seeds.spawn(1)[0]
+                    args = (seed, best['checkpoint'], best['version'])
+                pool.apply_async(_playAsyncEpisode, args, callback=onEpisode, error_callback=finished.put)
+
+            def onEpisode(result):
+                finished.put(result)
+                playNext()
+
+            pids = _poolWorkers(pool)
+            for _ in range(workers):
+                playNext()
+
+            arena, candidate = None, None
+            iterationTrainExamples = deque([], maxlen=self.args.maxlenOfQueue)
+            episodes, searched, merged = 0, 0, 0
+            i = 1
+            while i <= self.args.numIters:
+                try:
+                    result = finished.get(timeout=_WORKER_CHECK)
+                except queue.Empty:
+                    if _poolWorkers(pool) != pids:
+                        raise SelfPlayException('A self-play worker died, its game will never finish.')
+                    continue
+                if isinstance(result, BaseException):
+                    raise result
+                (examples, episode_searched, episode_merged), seconds = result
+                iterationTrainExamples += examples
+                episodes, searched, merged = episodes + 1, searched + episode_searched, merged + episode_merged
+                busy['self play'] += seconds
+
+                if arena is not None and arena.done():
+                    pwins, nwins, sprt, seconds = arena.result()
+                    busy['arena'] += seconds
+                    if self._gate(pwins, nwins, candidate, sprt):
+                        with lock:
+                            best['checkpoint'], best['version'] = (folder, candidate), best['version'] + 1
+                        if server is not None:
+                            server.reload(best['checkpoint'])
+                    arena = None
+
+                if episodes < self.args.numEps:
+                    continue
+
+                print('------ITER ' + str(i) + '------')
+                self.addTrainExamples(i, iterationTrainExamples)
+                if merged:
+                    log.info('Transpositions merged %s of %s searched boards (%.1f%%)',
+                             merged, searched, 100 * merged / searched)
+                self.evictTrainExamples()
+                self.saveTrainExamples(i - 1)
+
+                training_start = time.time()
+                self.nnet.train(self.trainExamplesHistory)
+                busy['training'] += time.time() - training_start
+                self.nnet.save_checkpoint(folder=folder, filename=self.getCheckpointFile(i))
+
+                if arena is None:
+                    candidate = self.getCheckpointFile(i)
+                    arena = arena_thread.submit(self._pitCheckpoints, best['checkpoint'], (folder, candidate))
+
+                elapsed = time.time() - start
+                log.info('Utilization: self play %.0f%% of %s workers, training %.0f%%, arena %.0f%%',
+                         100 * busy['self play'] / (elapsed * workers), workers,
+                         100 * busy['training'] / elapsed, 100 * busy['arena'] / elapsed)
+
+                iterationTrainExamples = deque([], maxlen=self.args.maxlenOfQueue)
+                episodes, searched, merged = 0, 0, 0
+                i += 1
+
+            stopping.set()
+            if arena is not None:
+                pwins, nwins, sprt, seconds = arena.result()
+                busy['arena'] += seconds
+                self._gate(pwins, nwins, candidate, sprt)
+        return busy
+
+    def _pitCheckpoints(self, previous, new):
+        """
+        ParallelArena between two checkpoints (folder, filename).
+        Returns previous wins, new wins, the SPRT used (or None), seconds.
+        """
+        start = time.time()
+        arena = ParallelArena(self.game, self.nnet.__class__, self.args, previous, new,
+                              self.args.numArenaWorkers or 1, self.args.arenaOpeningMoves or 0, self.args.seed)
+        sprt = self._newSprt()
+        pwins, nwins = arena.playGames(self.args.arenaCompare, sprt=sprt)
+        self._logArenaLength(arena)
+        return pwins, nwins, sprt, time.time() - start
+
+    def _newSprt(self):
+        """The sequential test that stops the arena early, if args.arenaEarlyStop is set."""
+        if not self.args.arenaEarlyStop:
+            return None
+        return SPRT(self.args.updateThreshold)
+
+    def _logArenaLength(self, arena):
+        if arena.gamesPlayed < self.args.arenaCompare:
+            log.info('Arena decided after %s of %s games (%s saved)', arena.gamesPlayed,
+                     self.args.arenaCompare, self.args.arenaCompare - arena.gamesPlayed)
+
+    def _gate(self, pwins, nwins, candidate, sprt=None):
+        """
+        Accept checkpoint candidate as the best one if it won enough games, or
+        if sprt decided for it. Returns whether it was accepted.
+        """
+        print()
+        print('Results')
+        print(f'Won: {nwins}')
+        print(f'Lost: {pwins}')
+        decision = sprt.decision() if sprt is not None else None
+        if decision is None:
+            # Undecided after all the games: fall back to the win rate.
+            decision = pwins + nwins > 0 and float(nwins) / (pwins + nwins) >= self.args.updateThreshold
+        if not decision:
+            print('REJECTING NEW MODEL')
+            return False
+        print('ACCEPTING NEW MODEL')
+        shutil.copyfile(os.path.join(self.args.checkpoint, candidate),
+                        os.path.join(self.args.checkpoint, 'checkpoint_best.pth.tar'))
+        self.saveTrainExamples('best')
+        return True
+
     def learn(self):
         """
         Performs numIters iterations with numEps episodes of self-play in each
@@ -97,66 +378,89 @@ class Coach():
             print('------ITER ' + str(i) + '------')
             # examples of the iteration
             if not self.skipFirstSelfPlay or i > 1:
-                iterationTrainExamples = deque([], maxlen=self.args.maxlenOfQueue)
-
-                for _ in tqdm(range(self.args.numEps), desc="Self Play", ncols=100):
-                    self.mcts = MCTS(self.game, self.nnet, self.args)  # reset search tree
-                    iterationTrainExamples += self.executeEpisode()
+                iterationTrainExamples, searched, merged = self.selfPlay()
 
                 # save the iteration examples to the history 
-                self.trainExamplesHistory.append(iterationTrainExamples)
+                self.addTrainExamples(i, iterationTrainExamples)
 
-            while len(self.trainExamplesHistory) > self.args.numItersForTrainExamplesHistory:
-                print("len(trainExamplesHistory) =", len(self.trainExamplesHistory),
-                      " => remove the oldest trainExamples")
-                self.trainExamplesHistory.pop(0)
+                if merged:
+                    log.info('Transpositions merged %s of %s searched boards (%.1f%%)',
+                             merged, searched, 100 * merged / searched)
+                if getattr(self.game, 'shot_cache', None) is not None:
+                    log.info('Shot cache: %s', self.game.shot_cache.stats())
+
+            dropped = self.evictTrainExamples()
+            if dropped:
+                print("Dropped", dropped, "examples of iterations older than the latest",
+                      self.args.numItersForTrainExamplesHistory)
             # backup history to a file
             # NOTE! the examples were collected using the model from the previous iteration, so (i-1)  
             self.saveTrainExamples(i - 1)
 
-            # shuffle examples before training
-            trainExamples = []
-            for e in self.trainExamplesHistory:
-                trainExamples.extend(e)
-            random.seed(time.time())
-            random.shuffle(trainExamples)
-
             # training new network, keeping a copy of the old one
             self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
-            self.pnet.load_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
-            pmcts = MCTS(self.game, self.pnet, self.args)
 
-            self.nnet.train(trainExamples)
-            nmcts = MCTS(self.game, self.nnet, self.args)
+            self.nnet.train(self.trainExamplesHistory)
+            self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=self.getCheckpointFile(i))
 
             print('PITTING AGAINST PREVIOUS VERSION')
-            arena = Arena(lambda x: np.argmax(pmcts.getActionProb(x, temp=0)),
-                          lambda x: np.argmax(nmcts.getActionProb(x, temp=0)), self.game)
-            pwins, nwins = arena.playGames(self.args.arenaCompare)
-
-            print()
-            print('Results')
-            print(f'Won: {nwins}')
-            print(f'Lost: {pwins}')
-            if pwins + nwins == 0 or float(nwins) / (pwins + nwins) < self.args.updateThreshold:
-                print('REJECTING NEW MODEL')
+            if (self.args.numArenaWorkers or 1) > 1:
+                arena = ParallelArena(self.game, self.nnet.__class__, self.args, (self.args.checkpoint, 'temp.pth.tar'),
+                                      (self.args.checkpoint, self.getCheckpointFile(i)), self.args.numArenaWorkers,
+                                      self.args.arenaOpeningMoves or 0, self.args.seed)
             else:
-                print('ACCEPTING NEW MODEL')
-                self.nnet.save_checkpoint(folder=self.args.checkpoint,
-                                          filename='checkpoint_best.pth.tar')
-                self.saveTrainExamples('best')
-            self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=self.getCheckpointFile(i))
+                if self.pnet is None:
+                    self.pnet = self.nnet.__class__(self.game)
+                self.pnet.load_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
+                pmcts = MCTS(self.game, self.pnet, self.args)
+                nmcts = MCTS(self.game, self.nnet, self.args)
+                arena = Arena(lambda x: np.argmax(pmcts.getActionProb(x, temp=0)),
+                              lambda x: np.argmax(nmcts.getActionProb(x, temp=0)), self.game)
+            sprt = self._newSprt()
+            pwins, nwins = arena.playGames(self.args.arenaCompare, sprt=sprt)
+            self._logArenaLength(arena)
+
+            self._gate(pwins, nwins, self.getCheckpointFile(i), sprt)
 
     def getCheckpointFile(self, iteration):
         return 'checkpoint_' + str(iteration) + '.pth.tar'
 
+    def addTrainExamples(self, iteration, examples):
+        """
+        Adds the (board, pi, v) examples of an iteration to the history and
+        writes them to their own chunk in args.checkpoint/examples. Chunks
+        are written once and never changed.
+        """
+        examples = list(examples)
+        if not examples:
+            return
+        arrays = [np.array(part, np.float32) for part in zip(*examples)]
+        self.trainExamplesHistory.addArrays(iteration, *arrays)
+
+        chunk = os.path.join('examples', f'iteration_{iteration}_{uuid.uuid4().hex[:8]}')
+        os.makedirs(os.path.join(self.args.checkpoint, 'examples'), exist_ok=True)
+        for part, array in zip(_CHUNK_PARTS, arrays):
+            np.save(os.path.join(self.args.checkpoint, f'{chunk}.{part}.npy'), array)
+        self.exampleChunks.append({'iteration': iteration, 'chunk': chunk, 'examples': len(examples)})
+
+    def evictTrainExamples(self):
+        """Drops iterations older than the latest numItersForTrainExamplesHistory. Returns the examples dropped."""
+        self.exampleChunks = self.exampleChunks[-self.args.numItersForTrainExamplesHistory:]
+        return self.trainExamplesHistory.evict(self.args.numItersForTrainExamplesHistory)
+
     def saveTrainExamples(self, iteration):
+        """
+        Writes the manifest of the history next to the checkpoint: the
+        chunks of its iterations, oldest first. Costs the same however long
+        the history is, as the examples are already in their chunks.
+        """
         folder = self.args.checkpoint
         if not os.path.exists(folder):
             os.makedirs(folder)
         filename = os.path.join(folder, self.getCheckpointFile(iteration) + ".examples")
-        with open(filename, "wb+") as f:
-            Pickler(f).dump(self.trainExamplesHistory)
+        with open(filename + ".tmp", "w") as f:
+            json.dump({'chunks': self.exampleChunks}, f)
+        os.replace(filename + ".tmp", filename)
 
     def loadTrainExamples(self):
         modelFile = os.path.join(self.args.load_folder_file[0], self.args.load_folder_file[1])
@@ -169,6 +473,31 @@ class Coach():
         else:
             log.debug("File with trainExamples found. Read it.")
             with open(examplesFile, "rb") as f:
-                self.trainExamplesHistory = Unpickler(f).load()
+                manifest = f.read(1) == b'{'
+                f.seek(0)
+                if manifest:
+                    self._loadChunks(os.path.dirname(examplesFile), json.load(f)['chunks'])
+                else:
+                    # Saved before example chunks: the whole history pickled.
+                    history = Unpickler(f).load()
+                    if isinstance(history, list):
+                        for label, examples in enumerate(history, -len(history)):
+                            self.trainExamplesHistory.add(label, examples)
+                    else:
+                        self.trainExamplesHistory = history
             # examples based on the model were already collected (loaded)
             self.skipFirstSelfPlay = True
+
+    def _loadChunks(self, folder, chunks):
+        """
+        Adds the newest numItersForTrainExamplesHistory chunks of a manifest
+        in folder to the history. Older chunks are never opened. The history
+        keeps the chunks memory-mapped and reads only the rows it samples.
+        """
+        chunks = chunks[-self.args.numItersForTrainExamplesHistory:]
+        # Labelled -n..-1 in the buffer so they never merge with this run's iterations.
+        for label, chunk in enumerate(chunks, -len(chunks)):
+            path = os.path.join(folder, chunk['chunk'])
+            self.trainExamplesHistory.addChunk(label, [f'{path}.{part}.npy' for part in _CHUNK_PARTS])
+            # Later manifests are saved in args.checkpoint.
+            self.exampleChunks.append(dict(chunk, chunk=os.path.relpath(path, self.args.checkpoint)))
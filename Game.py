@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class Game():
     """
     This class specifies the base Game class. To define your own game, subclass
@@ -44,6 +47,19 @@ class Game():
         """
         raise NotImplemented()
 
+    def getNextStates(self, board, player, actions):
+        """
+        Input:
+            board: current board
+            player: current player (1 or -1)
+            actions: list of actions to try from the same board
+
+        Returns:
+            nextBoards: array stacking the board after each action. The next
+                        player is -player for all of them.
+        """
+        return np.array([self.getNextState(board, player, a)[0] for a in actions])
+
     def getValidMoves(self, board, player):
         """
         Input:
@@ -99,6 +115,45 @@ class Game():
         """
         raise NotImplemented()
 
+    def getRandomSymmetries(self, boards, pis):
+        """
+        Input:
+            boards: array of boards stacked along the first axis
+            pis: array of their policy vectors, one row per board
+
+        Returns:
+            boards, pis: every board and pi replaced by a random symmetrical
+                         form of it (as in getSymmetries). Used to augment
+                         training minibatches. Defaults to no change.
+        """
+        return boards, pis
+
+    def getTransposition(self, board):
+        """
+        Input:
+            board: current board
+
+        Returns:
+            transposedBoard: a board shared by all boards that play the same
+                             as this one, up to a relabeling of actions. Used
+                             by MCTS to merge equivalent nodes.
+            actionMap: array where actionMap[a] is the action on
+                       transposedBoard that matches action a on board.
+                       Defaults to the board itself and identity.
+        """
+        return board, np.arange(self.getActionSize())
+
+    def stateKey(self, board):
+        """
+        Input:
+            board: current board
+
+        Returns:
+            key: a fast, hashable key for the board. Required by MCTS for
+                 hashing. Defaults to stringRepresentation.
+        """
+        return self.stringRepresentation(board)
+
     def stringRepresentation(self, board):
         """
         Input:
@@ -106,6 +161,5 @@ class Game():
 
         Returns:
             boardString: a quick conversion of board to a string format.
-                         Required by MCTS for hashing.
         """
         raise NotImplemented()
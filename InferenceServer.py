@@ -0,0 +1,183 @@
+import logging
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+
+from NeuralNet import NeuralNet
+
+log = logging.getLogger(__name__)
+
+_RELOAD = -1  # client id of requests that load new weights
+_ALIVE_CHECK = 1.0  # seconds a client waits for an answer between checks that the server is still running
+
+
+class InferenceServerException(Exception):
+    """The inference server stopped before answering."""
+
+
+class _Slot():
+    """Shared memory one client uses to pass boards to the server and get predictions back."""
+
+    def __init__(self, context, board_size, action_size, max_boards):
+        self.shapes = (max_boards,) + tuple(board_size), (max_boards, action_size), (max_boards,)
+        self.buffers = [context.RawArray('f', int(np.prod(shape))) for shape in self.shapes]
+        self.ready = context.Semaphore(0)
+
+    def arrays(self):
+        return [np.frombuffer(buffer, np.float32).reshape(shape) for buffer, shape in zip(self.buffers, self.shapes)]
+
+
+class InferenceClient(NeuralNet):
+    """
+    Stands in for a network inside self-play workers: predictions are sent to
+    an InferenceServer and wait for its answer. Can only be handed to other
+    processes when they start (e.g. Pool initargs).
+    """
+
+    def __init__(self, requests, slot, client_id, server_alive):
+        self.requests = requests
+        self.slot = slot
+        self.client_id = client_id
+        self.server_alive = server_alive  # read end of a pipe only the server's process writes to
+        self._arrays = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def predict(self, board):
+        pis, vs = self.predict_batch(board[None])
+        return pis[0], vs[0]
+
+    def predict_batch(self, boards):
+        if self._arrays is None:
+            self._arrays = self.slot.arrays()
+        board_slot, pi_slot, v_slot = self._arrays
+        if len(boards) > len(board_slot):
+            raise ValueError(f'{len(boards)} boards requested. The client was sized for {len(board_slot)}.')
+
+        board_slot[:len(boards)] = boards
+        self.requests.put((self.client_id, len(boards)))
+        while not self.slot.ready.acquire(timeout=_ALIVE_CHECK):
+            # Nothing is ever sent: the pipe turns readable (EOF) once the server's process is gone.
+            if self.server_alive.poll():
+                raise InferenceServerException('The inference server stopped before answering.')
+        return pi_slot[:len(boards)].copy(), v_slot[:len(boards)].astype(float)
+
+
+class InferenceServer():
+    """
+    A process that owns the network and answers predictions for many clients.
+
+    Requests waiting in the queue are run together: the server takes the
+    first one, then keeps collecting until the next would take it over
+    max_batch_size boards or max_wait seconds passed, and does one
+    predict_batch for all of them. The server's process runs the network on
+    threads threads (torch.set_num_threads), if given.
+    Boards and predictions go through shared memory; the queue only carries
+    client ids.
+
+    Use as a context manager:
+
+        with InferenceServer(game, NNet, (folder, filename), clients=4) as server:
+            nnet = server.clients[0]  # has the same predict as NNet
+    """
+
+    def __init__(self, game, nnet_class, checkpoint, clients, max_boards=1, max_batch_size=64, max_wait=0.002,
+                 threads=None):
+        self.game = game
+        self.nnet_class = nnet_class
+        self.checkpoint = checkpoint
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        context = multiprocessing.get_context('spawn')
+        self.requests = context.Queue()
+        slots = [_Slot(context, game.getBoardSize(), game.getActionSize(), max_boards) for _ in range(clients)]
+        server_alive, self._alive_writer = context.Pipe(duplex=False)
+        self.clients = [InferenceClient(self.requests, slot, i, server_alive) for i, slot in enumerate(slots)]
+        self.process = context.Process(
+            target=_serve,
+            args=(game, nnet_class, checkpoint, self.requests, slots, max_batch_size, max_wait, threads,
+                  self._alive_writer),
+            daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.process.start()
+        # Only the server's process keeps the write end open, so it closes when that process ends, however it ends.
+        self._alive_writer.close()
+
+    def stop(self):
+        self.requests.put(None)
+        self.process.join()
+
+    def reload(self, checkpoint):
+        """Load new weights from checkpoint (folder, filename). Predictions requested after this call use them."""
+        self.requests.put((_RELOAD, checkpoint))
+
+
+def _serve(game, nnet_class, checkpoint, requests, slots, max_batch_size, max_wait, threads, alive_writer):
+    # alive_writer is only held open for as long as this process runs. See InferenceServer.start.
+    if threads:
+        # Spawned processes re-import main.py, which leaves self-play workers a single thread.
+        import torch
+        torch.set_num_threads(threads)
+    nnet = nnet_class(game)
+    nnet.load_checkpoint(*checkpoint)
+    arrays = [slot.arrays() for slot in slots]
+    batches, boards_served = 0, 0
+
+    running = True
+    pending = None  # a request that didn't fit in the last batch
+    while running:
+        request, pending = pending or requests.get(), None
+        if request is None:
+            break
+        if request[0] == _RELOAD:
+            nnet.load_checkpoint(*request[1])
+            continue
+        batch, size, reload = [request], request[1], None
+        deadline = time.monotonic() + max_wait
+        while size < max_batch_size:
+            try:
+                request = requests.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if request is None:
+                running = False
+                break
+            if request[0] == _RELOAD:
+                # Requests up to here were made for the old weights.
+                reload = request[1]
+                break
+            if size + request[1] > max_batch_size:
+                pending = request
+                break
+            batch.append(request)
+            size += request[1]
+
+        boards = np.concatenate([arrays[client_id][0][:n] for client_id, n in batch])
+        pis, vs = nnet.predict_batch(boards)
+        offset = 0
+        for client_id, n in batch:
+            _, pi_slot, v_slot = arrays[client_id]
+            pi_slot[:n] = pis[offset:offset + n]
+            v_slot[:n] = np.reshape(vs, -1)[offset:offset + n]
+            offset += n
+            slots[client_id].ready.release()
+        batches, boards_served = batches + 1, boards_served + size
+        if reload is not None:
+            nnet.load_checkpoint(*reload)
+
+    log.info('Inference server answered %s boards in %s batches (%.1f per batch)',
+             boards_served, batches, boards_served / batches if batches else 0)
@@ -7,6 +7,7 @@ from tqdm import tqdm
 tqdm.monitor_interval = 0
 
 EPS = 1e-8
+VIRTUAL_LOSS = 1  # visits, each counted as a loss, added to every edge of a path pending evaluation
 
 log = logging.getLogger(__name__)
 
@@ -14,38 +15,68 @@ log = logging.getLogger(__name__)
 class MCTS():
     """
     This class handles the MCTS tree.
+
+    Every board reached by the search is a node: a row in the arrays below, found through `nodes` by its state key.
     """
 
     def __init__(self, game, nnet, args):
         self.game = game
         self.nnet = nnet
         self.args = args
-        self.Qsa = {}  # stores Q values for s,a (as defined in the paper)
-        self.Nsa = {}  # stores #times edge s,a was visited
-        self.Ns = {}  # stores #times board s was visited
-        self.Ps = {}  # stores initial policy (returned by neural net)
-
-        self.Es = {}  # stores game.getGameEnded ended for board s
-        self.Vs = {}  # stores game.getValidMoves for board s
-
-    def getActionProb(self, canonicalBoard, temp=1):
+        self.nodes = {}  # stores the row of board s, keyed by game.stateKey
+        self.size = 0  # rows in use
+
+        actions = self.game.getActionSize()
+        capacity = 64
+        self.Qsa = np.zeros((capacity, actions))  # stores Q values for s,a (as defined in the paper)
+        self.Nsa = np.zeros((capacity, actions))  # stores #times edge s,a was visited
+        self.Ns = np.zeros(capacity)  # stores #times board s was visited
+        self.Ps = np.zeros((capacity, actions))  # stores initial policy (returned by neural net)
+
+        self.Es = np.zeros(capacity)  # stores game.getGameEnded ended for board s
+        self.Vs = np.zeros((capacity, actions), bool)  # stores game.getValidMoves for board s
+        self.expanded = np.zeros(capacity, bool)  # Ps and Vs are set for board s
+        self.children = np.full((capacity, actions), -1)  # stores the row reached by edge s,a
+        self.boards = np.zeros((capacity,) + tuple(self.game.getBoardSize()))  # stores board s
+        self.VLsa = np.zeros((capacity, actions))  # stores virtual loss on edge s,a from paths pending evaluation
+        self.VLs = np.zeros(capacity)  # stores virtual loss on board s
+
+        self.kept = None  # row of the root prune() kept, whose visits count towards numMCTSSims once
+        self.Rs = set()  # stores keys of boards as searched, before game.getTransposition
+        self.merged = 0  # boards in Rs that landed on a node first reached from another board
+
+    def getActionProb(self, canonicalBoard, temp=1, rng=np.random):
         """
         This function performs numMCTSSims simulations of MCTS starting from
-        canonicalBoard.
+        canonicalBoard. With temp=0, ties are broken with rng.
 
         Returns:
             probs: a policy vector where the probability of the ith action is
                    proportional to Nsa[(s,a)]**(1./temp)
         """
-        for i in tqdm(range(self.args.numMCTSSims), desc="MCTS", leave=False, ncols=100):
-            self.search(canonicalBoard)
+        batch_size = self.args.mctsBatchSize or 1
+        root = self._get_node(canonicalBoard)
+        done = 0
+        if root == self.kept:
+            # Visits kept from earlier moves (see prune) count towards numMCTSSims.
+            done = min(int(self.Ns[root]) + int(self.expanded[root]), self.args.numMCTSSims)
+            self.kept = None
+        with tqdm(total=self.args.numMCTSSims, initial=done, desc="MCTS", leave=False, ncols=100) as progress:
+            while done < self.args.numMCTSSims:
+                if batch_size == 1:
+                    self.search(canonicalBoard)
+                    searched = 1
+                else:
+                    searched = self.searchBatch(canonicalBoard, min(batch_size, self.args.numMCTSSims - done))
+                done += searched
+                progress.update(searched)
 
-        s = self.game.stringRepresentation(canonicalBoard)
-        counts = [self.Nsa[(s, a)] if (s, a) in self.Nsa else 0 for a in range(self.game.getActionSize())]
+        _, action_map = self.game.getTransposition(canonicalBoard)
+        counts = self.Nsa[root, action_map].tolist()
 
         if temp == 0:
             bestAs = np.array(np.argwhere(counts == np.max(counts))).flatten()
-            bestA = np.random.choice(bestAs)
+            bestA = rng.choice(bestAs)
 
             probs = [0] * len(counts)
             probs[bestA] = 1
@@ -58,9 +89,9 @@ class MCTS():
 
     def search(self, canonicalBoard):
         """
-        This function performs one iteration of MCTS. It is recursively called
-        till a leaf node is found. The action chosen at each node is one that
-        has the maximum upper confidence bound as in the paper.
+        This function performs one iteration of MCTS. It descends from
+        canonicalBoard till a leaf node is found. The action chosen at each
+        node is one that has the maximum upper confidence bound as in the paper.
 
         Once a leaf node is found, the neural network is called to return an
         initial policy P and a value v for the state. This value is propagated
@@ -68,90 +99,201 @@ class MCTS():
         outcome is propagated up the search path. The values of Ns, Nsa, Qsa are
         updated.
 
-        NOTE: the return values are the negative of the value of the current
-          state. This is done since v is in [-1,1] and if v is the value of a
-          state for the current player, then its value is -v for the other player.
+        NOTE: the values backed up are negated at every level. This is done
+          since v is in [-1,1] and if v is the value of a state for the current
+          player, then its value is -v for the other player.
 
         Returns:
             v: the negative of the `value` of the current canonicalBoard
         """
-
-        s = self.game.stringRepresentation(canonicalBoard)
-        log.debug('search() stringRepresentation (s): %s', s)
-
-        if s not in self.Es:
-            self.Es[s] = self.game.getGameEnded(canonicalBoard, 1)
-            log.debug('Es[s]: %s', self.Es[s])
-
+        path, s = self._descend(self._get_node(canonicalBoard))
         if self.Es[s] != 0:
             # terminal node
-            return -self.Es[s]
-
-        if s not in self.Ps:
-            v = self._populate_Pss(canonicalBoard, s)
-            return -v
-
-        a = self._get_best_action(s)
-        next_s, next_player = self.game.getNextState(canonicalBoard, 1, a)
-        next_s = self.game.getCanonicalForm(next_s, next_player)
-
-        v = self.search(next_s)
+            v = -self.Es[s]
+        else:
+            v = -self._populate_Pss(s)
+        return self._backup(path, v)
 
-        if (s, a) in self.Qsa:
-            self.Qsa[(s, a)] = (self.Nsa[(s, a)] * self.Qsa[(s, a)] + v) / (self.Nsa[(s, a)] + 1)
-            self.Nsa[(s, a)] += 1
+    def searchBatch(self, canonicalBoard, k):
+        """
+        Up to k iterations of MCTS with one call to nnet.predict_batch for
+        all their leaves. Every path adds a virtual loss to its edges, so the
+        next path is steered elsewhere. Stops early if a path ends on a leaf
+        that is already pending.
 
-        else:
-            self.Qsa[(s, a)] = v
-            self.Nsa[(s, a)] = 1
+        Returns:
+            searched: the number of paths backed up
+        """
+        paths, leaves = [], []
+        searched = 0
+        for _ in range(k):
+            path, s = self._descend(self._get_node(canonicalBoard), virtual_loss=VIRTUAL_LOSS)
+            if self.Es[s] != 0:
+                # terminal node
+                self._add_virtual_loss(path, -VIRTUAL_LOSS)
+                self._backup(path, -self.Es[s])
+                searched += 1
+                continue
+            if s in leaves:
+                self._add_virtual_loss(path, -VIRTUAL_LOSS)
+                break
+            paths.append(path)
+            leaves.append(s)
+
+        if leaves:
+            values = self._populate_Pss_batch(leaves)
+            for path, v in zip(paths, values):
+                self._add_virtual_loss(path, -VIRTUAL_LOSS)
+                self._backup(path, -v)
+        return searched + len(leaves)
+
+    def _descend(self, s, virtual_loss=0):
+        """Follow the best actions from row s to a leaf or terminal node. Returns the (s, a) path and the last row."""
+        path = []
+        while self.Es[s] == 0 and self.expanded[s]:
+            a = self._get_best_action(s)
+            path.append((s, a))
+            if virtual_loss:
+                self._add_virtual_loss([(s, a)], virtual_loss)
+            if self.children[s, a] < 0:
+                next_s, next_player = self.game.getNextState(self.boards[s], 1, a)
+                next_s = self.game.getCanonicalForm(next_s, next_player)
+                self.children[s, a] = self._get_node(next_s)
+            s = self.children[s, a]
+        return path, s
+
+    def _backup(self, path, v):
+        for s, a in reversed(path):
+            self.Qsa[s, a] = (self.Nsa[s, a] * self.Qsa[s, a] + v) / (self.Nsa[s, a] + 1)
+            self.Nsa[s, a] += 1
+            self.Ns[s] += 1
+            v = -v
+        return v
 
-        self.Ns[s] += 1
-        return -v
+    def _add_virtual_loss(self, path, virtual_loss):
+        for s, a in path:
+            self.VLsa[s, a] += virtual_loss
+            self.VLs[s] += virtual_loss
 
-    def _populate_Pss(self, canonicalBoard, s):
+    def prune(self, canonicalBoard):
+        """
+        Make canonicalBoard the root of the tree. Nodes reachable from it keep
+        their statistics, everything else is dropped. Starts over if
+        canonicalBoard was never reached. The next getActionProb from it
+        counts the visits kept towards numMCTSSims.
+        """
+        board, _ = self.game.getTransposition(canonicalBoard)
+        root = self.nodes.get(self.game.stateKey(board))
+        if root is None:
+            log.debug('prune: board not in the tree. Starting over.')
+            self.__init__(self.game, self.nnet, self.args)
+            return
+
+        rows, seen = [root], {root}
+        for s in rows:
+            for child in self.children[s][self.children[s] >= 0].tolist():
+                if child not in seen:
+                    seen.add(child)
+                    rows.append(child)
+        log.debug('prune: keeping %s of %s nodes', len(rows), self.size)
+
+        rows = np.array(rows)
+        new_rows = np.full(self.size, -1)
+        new_rows[rows] = np.arange(len(rows))
+        children = self.children[rows]
+        for name in ('Qsa', 'Nsa', 'Ns', 'Ps', 'Es', 'Vs', 'expanded', 'children', 'boards', 'VLsa', 'VLs'):
+            array = getattr(self, name)
+            array[:len(rows)] = array[rows]
+            array[len(rows):self.size] = -1 if name == 'children' else 0
+        self.children[:len(rows)] = np.where(children >= 0, new_rows[children], -1)
+        self.nodes = {key: int(new_rows[s]) for key, s in self.nodes.items() if new_rows[s] >= 0}
+        self.size = len(rows)
+        self.kept = 0
+
+    def _get_node(self, canonicalBoard):
+        """Row of canonicalBoard, added if it's new."""
+        board, _ = self.game.getTransposition(canonicalBoard)
+        key = self.game.stateKey(board)
+        log.debug('search() stateKey (s): %s', key)
+
+        r = key if board is canonicalBoard else self.game.stateKey(canonicalBoard)
+        if r not in self.Rs:
+            self.Rs.add(r)
+            if key in self.nodes:
+                self.merged += 1
+
+        s = self.nodes.get(key)
+        if s is None:
+            if self.size == len(self.Ns):
+                self._grow()
+            s = self.nodes[key] = self.size
+            self.size += 1
+            self.boards[s] = board
+            self.Es[s] = self.game.getGameEnded(board, 1)
+            log.debug('Es[s]: %s', self.Es[s])
+        return s
+
+    def _grow(self):
+        for name in ('Qsa', 'Nsa', 'Ns', 'Ps', 'Es', 'Vs', 'expanded', 'children', 'boards', 'VLsa', 'VLs'):
+            old = getattr(self, name)
+            new = np.zeros((2 * len(old),) + old.shape[1:], old.dtype)
+            if name == 'children':
+                new.fill(-1)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _populate_Pss(self, s):
         # leaf node
-        self.Ps[s], v = self.nnet.predict(canonicalBoard)
-        valids = self.game.getValidMoves(canonicalBoard, 1)
-        self.Ps[s] = self.Ps[s] * valids  # masking invalid moves
-        sum_Ps_s = np.sum(self.Ps[s])
+        Ps, v = self.nnet.predict(self.boards[s])
+        self._set_Ps(s, Ps)
+        return np.asarray(v).item()
+
+    def _populate_Pss_batch(self, rows):
+        # leaf nodes
+        Ps, v = self.nnet.predict_batch(self.boards[rows])
+        for s, p in zip(rows, Ps):
+            self._set_Ps(s, p)
+        return np.asarray(v, dtype=float).reshape(len(rows))
+
+    def _set_Ps(self, s, Ps):
+        valids = self.game.getValidMoves(self.boards[s], 1)
+        Ps = Ps * valids  # masking invalid moves
+        sum_Ps_s = np.sum(Ps)
         if sum_Ps_s > 0:
-            self.Ps[s] /= sum_Ps_s  # renormalize
+            Ps /= sum_Ps_s  # renormalize
         else:
             # if all valid moves were masked make all valid moves equally probable
 
             # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
             # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.
             print("All valid moves were masked, doing a workaround.")
-            print(f"Ps[s] = {self.Ps[s]}")
+            print(f"Ps[s] = {Ps}")
             print(f"valids = {valids}")
-            self.Ps[s] = self.Ps[s] + valids
-            self.Ps[s] /= np.sum(self.Ps[s])
+            Ps = Ps + valids
+            Ps /= np.sum(Ps)
+        self.Ps[s] = Ps
         self.Vs[s] = valids
         self.Ns[s] = 0
-        return v
+        self.expanded[s] = True
 
     def _get_best_action(self, s):
         """pick the action with the highest upper confidence bound"""
 
         valids = self.Vs[s]
-        cur_best = -float('inf')
-        best_act = -1
-        action_size = self.game.getActionSize()
-        for a in range(action_size):
-            if valids[a]:
-                if (s, a) in self.Qsa:
-                    u = self.Qsa[(s, a)] + self.args.cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s]) / (
-                            1 + self.Nsa[(s, a)])
-                else:
-                    u = self.args.cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s] + EPS)  # Q = 0 ?
-
-                if u > cur_best:
-                    cur_best = u
-                    best_act = a
-        if best_act < 0:
-            log.error('Failed to find best action: %s', best_act)
-            log.error('Action size: %s', action_size)
-            log.error('Valid choices: %s', sum(valids))
+        if not valids.any():
+            log.error('Failed to find best action.')
+            log.error('Action size: %s', self.game.getActionSize())
+            log.error('Valid choices: %s', valids.sum())
             raise Exception('Sanity check failed.')
-        a = best_act
-        return a
+
+        Qsa, Nsa, Ns, Ps = self.Qsa[s], self.Nsa[s], self.Ns[s], self.Ps[s]
+        if self.VLs[s]:
+            # Paths pending evaluation count as lost visits.
+            VLsa = self.VLsa[s]
+            Qsa = np.where(VLsa > 0, (Nsa * Qsa - VLsa) / np.maximum(Nsa + VLsa, 1), Qsa)
+            Nsa, Ns = Nsa + VLsa, Ns + self.VLs[s]
+        u = np.where(Nsa > 0,
+                     Qsa + self.args.cpuct * Ps * math.sqrt(Ns) / (1 + Nsa),
+                     self.args.cpuct * Ps * math.sqrt(Ns + EPS))  # Q = 0 ?
+        u[~valids] = -np.inf
+        return int(np.argmax(u))
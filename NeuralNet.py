@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class NeuralNet():
     """
     This class specifies the base NeuralNet class. To define your own neural
@@ -20,7 +23,9 @@ class NeuralNet():
             examples: a list of training examples, where each example is of form
                       (board, pi, v). pi is the MCTS informed policy vector for
                       the given board, and v is its value. The examples has
-                      board in its canonical form.
+                      board in its canonical form. Coach passes a
+                      ReplayBuffer, which also draws whole minibatches with
+                      sample(batch_size).
         """
         pass
 
@@ -36,6 +41,21 @@ class NeuralNet():
         """
         pass
 
+    def predict_batch(self, boards):
+        """
+        Input:
+            boards: array of boards in their canonical form, stacked along the
+                    first axis.
+
+        Returns:
+            pis: array of policy vectors, one row per board
+            vs: array of values, one per board
+
+        Defaults to calling predict on every board.
+        """
+        pis, vs = zip(*[self.predict(board) for board in boards])
+        return np.array(pis), np.array(vs, dtype=float).reshape(len(boards))
+
     def save_checkpoint(self, folder, filename):
         """
         Saves the current neural network (with its parameters) in
@@ -0,0 +1,173 @@
+from collections import deque
+
+import numpy as np
+
+
+class ReplayBuffer():
+    """
+    Training examples (board, pi, v) in preallocated float32 arrays used as a
+    ring: new examples overwrite the oldest ones once capacity is reached.
+
+    Examples are added per iteration of self-play, and evict() drops whole
+    iterations by age. sample() draws a minibatch with one fancy index per
+    array instead of zipping Python tuples back together.
+
+    Iterations stored on disk (addChunk) stay there, memory-mapped: only the
+    rows sample() draws from them are read.
+
+    Supports len() and indexing (oldest example first) like the list of
+    examples it replaces.
+    """
+
+    def __init__(self, board_size, action_size, capacity):
+        self.capacity = capacity
+        self.boards = np.zeros((capacity,) + tuple(board_size), np.float32)
+        self.pis = np.zeros((capacity, action_size), np.float32)
+        self.vs = np.zeros(capacity, np.float32)
+        self.segments = deque()  # [iteration, examples] of every iteration in the arrays, oldest first
+        self.start = 0  # index of the oldest example in the arrays
+        self.size = 0  # examples in the arrays
+        self.chunks = deque()  # [iteration, files, first row, examples] of every iteration on disk, oldest first
+        self.mapped = 0  # examples in chunks
+        self._maps = {}  # files -> their memory-mapped boards, pis and vs, opened on first read
+
+    @classmethod
+    def fromExamples(cls, examples, iteration=0):
+        """A buffer just big enough for a list of (board, pi, v) examples."""
+        board, pi, _ = examples[0]
+        buffer = cls(np.shape(board), len(pi), len(examples))
+        buffer.add(iteration, examples)
+        return buffer
+
+    def __len__(self):
+        return self.mapped + self.size
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        boards, pis, vs = self._rows(np.array([i % len(self)]))
+        return boards[0], pis[0], float(vs[0])
+
+    def __getstate__(self):
+        # Only the examples in use, oldest first. Chunks stay on disk.
+        state = self.__dict__.copy()
+        indices = self._indices()
+        state.update(boards=self.boards[indices], pis=self.pis[indices], vs=self.vs[indices], start=0, _maps={})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for name in ('boards', 'pis', 'vs'):
+            stored = getattr(self, name)
+            array = np.zeros((self.capacity,) + stored.shape[1:], np.float32)
+            array[:len(stored)] = stored
+            setattr(self, name, array)
+
+    def iterations(self):
+        """Iterations with examples in the buffer, oldest first."""
+        return [chunk[0] for chunk in self.chunks] + [iteration for iteration, _ in self.segments]
+
+    def addChunk(self, iteration, files):
+        """
+        Adds the examples of an iteration saved as .npy files of boards, pis
+        and vs. They are memory-mapped, not copied. Chunks are the oldest
+        examples, so they can only be added before any add().
+        """
+        if self.size:
+            raise ValueError('Chunks have to be added before other examples.')
+        files = tuple(files)
+        self.chunks.append([iteration, files, 0, len(self._open(files)[2])])
+        self.mapped += self.chunks[-1][3]
+        if len(self) > self.capacity:
+            self._drop(len(self) - self.capacity)
+
+    def add(self, iteration, examples):
+        """
+        Appends (board, pi, v) examples to iteration: to the newest segment
+        if it has the same iteration, else as a new segment. Overwrites the
+        oldest examples if the buffer is full.
+        """
+        examples = list(examples)
+        if examples:
+            self.addArrays(iteration, *zip(*examples))
+
+    def addArrays(self, iteration, boards, pis, vs):
+        """add() for examples given as arrays of boards, pis and vs."""
+        boards, pis, vs = boards[-self.capacity:], pis[-self.capacity:], vs[-self.capacity:]
+        if not len(vs):
+            return
+        free = self.capacity - len(self)
+        if len(vs) > free:
+            self._drop(len(vs) - free)
+
+        indices = (self.start + self.size + np.arange(len(vs))) % self.capacity
+        self.boards[indices] = boards
+        self.pis[indices] = pis
+        self.vs[indices] = vs
+        self.size += len(vs)
+        if self.segments and self.segments[-1][0] == iteration:
+            self.segments[-1][1] += len(vs)
+        else:
+            self.segments.append([iteration, len(vs)])
+
+    def evict(self, iterations):
+        """Drops all but the newest iterations. Returns the number of examples dropped."""
+        sizes = [chunk[3] for chunk in self.chunks] + [examples for _, examples in self.segments]
+        dropped = sum(sizes[:max(len(sizes) - iterations, 0)])
+        self._drop(dropped)
+        return dropped
+
+    def sample(self, batch_size):
+        """batch_size random examples, drawn with replacement. Returns boards, pis and vs arrays."""
+        if not self.chunks:
+            indices = (self.start + np.random.randint(self.size, size=batch_size)) % self.capacity
+            return self.boards[indices], self.pis[indices], self.vs[indices]
+        return self._rows(np.random.randint(len(self), size=batch_size))
+
+    def _indices(self):
+        return (self.start + np.arange(self.size)) % self.capacity
+
+    def _open(self, files):
+        if files not in self._maps:
+            self._maps[files] = [np.load(f, mmap_mode='r') for f in files]
+        return self._maps[files]
+
+    def _rows(self, positions):
+        """Boards, pis and vs of the examples at positions, counted from the oldest."""
+        rows = (np.empty((len(positions),) + self.boards.shape[1:], np.float32),
+                np.empty((len(positions),) + self.pis.shape[1:], np.float32),
+                np.empty(len(positions), np.float32))
+        offset = 0
+        for _, files, first, examples in self.chunks:
+            inside = (positions >= offset) & (positions < offset + examples)
+            if inside.any():
+                for out, array in zip(rows, self._open(files)):
+                    out[inside] = array[first + positions[inside] - offset]
+            offset += examples
+        inside = positions >= offset
+        indices = (self.start + positions[inside] - offset) % self.capacity
+        for out, array in zip(rows, (self.boards, self.pis, self.vs)):
+            out[inside] = array[indices]
+        return rows
+
+    def _drop(self, n):
+        """Removes the n oldest examples."""
+        while n > 0 and self.chunks:
+            chunk = self.chunks[0]
+            dropped = min(n, chunk[3])
+            chunk[2] += dropped
+            chunk[3] -= dropped
+            if chunk[3] == 0:
+                self.chunks.popleft()
+                self._maps.pop(chunk[1], None)
+            self.mapped -= dropped
+            n -= dropped
+        while n > 0:
+            segment = self.segments[0]
+            dropped = min(n, segment[1])
+            segment[1] -= dropped
+            if segment[1] == 0:
+                self.segments.popleft()
+            self.start = (self.start + dropped) % self.capacity
+            self.size -= dropped
+            n -= dropped
@@ -28,12 +28,14 @@ root.setLevel('INFO')
 logging.getLogger('engineio').setLevel('WARN')
 logging.getLogger('socketio').setLevel('WARN')
 
-game = CurlingGame()
+game = CurlingGame(shot_cache_file=c.SHOT_CACHE_FILE, use_transpositions=True)
 
 log.info('Loading NNet for Curling...')
 nnet = NNet(game)
 log.info('Loading checkpoint...')
 nnet.load_checkpoint('./kirill/ann_6_features/', 'checkpoint_best.pth.tar')
+# One search tree for the whole session. Each turn starts from what earlier turns searched.
+mcts = MCTS(game, nnet, utils.dotdict({'numMCTSSims': 128, 'cpuct': 1.0}))
 log.info('Ready! 🚀 ')
 
 AZ_TEAM = int(os.environ.get('AZ_TEAM', '0'))
@@ -59,10 +61,9 @@ def get_best_action_web(board, use_mcts: bool, player: AZ_TEAM_OMO):
 
 def get_best_action(board, player, use_mcts):
     if use_mcts:
-        args1 = utils.dotdict({'numMCTSSims': 128, 'cpuct': 1.0})
-        mcts1 = MCTS(game, nnet, args1)
         board = game.getCanonicalForm(board, player)
-        best_action = int(np.argmax(mcts1.getActionProb(board, temp=0)))
+        mcts.prune(board)  # Keeps what earlier turns of this game already searched under this board.
+        best_action = int(np.argmax(mcts.getActionProb(board, temp=0)))
     else:
         p, v = nnet.predict(board)
         best_action = int(np.argmax(p))
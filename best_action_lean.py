@@ -0,0 +1,31 @@
+"""
+best_action.py for a model exported with pytorch/export.py: provides 1 action
+that the network would take given a board input. Only loads NumPy and the
+exported model, so it answers in a fraction of best_action.py's start up.
+"""
+import argparse
+import json
+
+import numpy as np
+
+from pytorch.runtime import ExportedModel
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--board', '-b', type=str, help='String representation of a board', required=True)
+parser.add_argument('--model', '-m', type=str, help='Model exported by pytorch/export.py',
+                    default='./curling/data_image/best.npz')
+
+args = parser.parse_args()
+
+model = ExportedModel(args.model)
+board = np.array(json.loads(args.board))  # CurlingGame.boardFromString
+
+p, v = model.predict(board)
+best_action = int(np.argmax(p))
+
+handle, weight, broom = model.metadata['action_list'][best_action]  # curling.utils.decodeAction
+print(json.dumps({
+    "handle": handle,
+    "weight": weight,
+    "broom": broom
+}))
@@ -0,0 +1,274 @@
+"""
+Vectorized stone physics for many boards at once.
+
+`BatchSimulation` holds N boards x 16 stones as NumPy arrays and advances all
+of them together with the same model as the pymunk backend in `simulation`:
+ice friction and curl from `utils.stone_velocity`, elastic stone-stone
+collisions with tangential friction, removal on wall contact and the 5-rock
+rule. Results match pymunk to within `POSITION_TOLERANCE` inches on empty ice.
+Collisions use a simpler impulse solver than chipmunk, so after contact only
+`COLLISION_AGREEMENT` of shots are guaranteed to land within that tolerance
+(see curling/test_batch_simulation.py).
+
+The speed-up comes from the batch: a single shot costs about 2x a pymunk run
+(python -m curling.benchmark_physics).
+"""
+import logging
+import math
+
+import numpy as np
+
+from curling import board as board_utils
+from curling import constants as c
+from curling import simulation
+from curling import utils
+
+log = logging.getLogger(__name__)
+
+# pymunk derives body mass from the shape density (1) rather than `Stone.mass`.
+BODY_MASS = math.pi * utils.STONE_RADIUS ** 2
+BODY_MOMENT = BODY_MASS * utils.STONE_RADIUS ** 2 / 2.0
+
+# chipmunk multiplies the coefficients of both shapes in contact.
+ELASTICITY = utils.STONE_ELASTICITY ** 2
+FRICTION = utils.STONE_FRICTION ** 2
+
+WALL_RADIUS = 0.1
+WALL_LEFT = -utils.ICE_WIDTH / 2
+WALL_RIGHT = utils.ICE_WIDTH / 2
+WALL_BACK = utils.BACKLINE_ELIM
+
+FRICTION_ACCEL = c.SURFACE_FRICTION * utils.dist(meters=c.G_FORCE)
+ANGULAR_DAMPING = 0.001
+MOVING_VELOCITY = 0.01
+SOLVER_ITERATIONS = 4
+
+POSITION_TOLERANCE = 1.0  # inches, agreement with the pymunk backend
+COLLISION_AGREEMENT = 0.9  # fraction of shots with contact that stay within POSITION_TOLERANCE
+
+_GUARD_HOG_LINE = utils.STONE_RADIUS + utils.dist(feet=6 + 6 + 21 + 72)
+_GUARD_TEE_LINE = _GUARD_HOG_LINE + utils.dist(feet=21)
+_GUARD_HOUSE = utils.dist(feet=6) + utils.STONE_RADIUS
+
+_TEAM = np.array([c.P1] * 8 + [c.P2] * 8)
+_STONE_IDS = np.arange(16)
+
+
+def is_guard(x: np.array, y: np.array) -> np.array:
+    """Vectorized `utils.Stone.updateGuardValue`."""
+    from_pin = np.hypot(x, y - _GUARD_TEE_LINE)
+    return (y < _GUARD_TEE_LINE) & (from_pin > _GUARD_HOUSE)
+
+
+def curl_acceleration(velocity: np.array, speed: np.array, spin: np.array) -> np.array:
+    """Vectorized `utils.getCurlingForce` divided by the body mass."""
+    s = speed / 25
+    curl = (s * 1300) * np.exp(-(s ** 2 * 0.2 + 1.5))
+    curl = np.where(np.abs(spin) < 0.01, 0, curl) / BODY_MASS
+    direction = np.where(spin < 0, -1.0, 1.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.where(speed > 0, curl * direction / speed, 0)
+    # Rotating the velocity by +/-90 degrees
+    return np.stack((-velocity[..., 1] * scale, velocity[..., 0] * scale), axis=-1)
+
+
+class BatchSimulation:
+
+    def __init__(self):
+        self.setupBoards(np.array([board_utils.getInitBoard()]))
+
+    def __len__(self):
+        return len(self.position)
+
+    def setupBoards(self, boards: np.array):
+        """Load a stack of boards shaped (N, 6, 16). Stones start at rest."""
+        boards = np.array(boards, dtype=float)
+        log.debug('setupBoards(%s boards)', len(boards))
+        self.boards_before_action = boards.copy()
+
+        self.thrown = boards[:, c.BOARD_THROWN].copy()
+        self.in_play = boards[:, c.BOARD_IN_PLAY].copy()
+        self.active = (self.thrown == c.THROWN) & (self.in_play == c.IN_PLAY)
+
+        self.position = np.stack((boards[:, c.BOARD_X], boards[:, c.BOARD_Y]), axis=-1)
+        self.position[~self.active] = 0
+        self.velocity = np.zeros_like(self.position)
+        self.spin = np.zeros_like(self.thrown)
+        self.guard = is_guard(self.position[..., 0], self.position[..., 1])
+
+        self.shooter = np.full(len(boards), -1)
+        self.shooter_team = np.zeros(len(boards), int)
+        self.five_rock_rule_violation = np.zeros(len(boards), bool)
+
+    def setupActions(self, players, actions):
+        """Add one shooter per board at (0, 0). `players` may be a scalar."""
+        size = len(self)
+        players = np.broadcast_to(players, (size,))
+        actions = np.broadcast_to(actions, (size,))
+        log.debug('setupActions(%s, %s)', players, actions)
+
+        for i, (player, action) in enumerate(zip(players, actions)):
+            board = self.getBoard(i)
+            stone_id = simulation.getNextStoneId(board)
+            if player == c.P2:
+                stone_id += 8
+            handle, weight, broom = utils.decodeAction(action)
+            velocity = utils.calculateVelocityVector(weight, broom)
+
+            self.position[i, stone_id] = 0, 0
+            self.velocity[i, stone_id] = velocity.x, velocity.y
+            self.spin[i, stone_id] = handle
+            self.guard[i, stone_id] = is_guard(0, 0)
+            self.thrown[i, stone_id] = c.THROWN
+            self.in_play[i, stone_id] = c.IN_PLAY
+            self.active[i, stone_id] = True
+            self.shooter[i] = stone_id
+            self.shooter_team[i] = player
+
+    def getBoard(self, i: int) -> np.array:
+        board = board_utils.getInitBoard()
+        board[c.BOARD_THROWN] = self.thrown[i]
+        board[c.BOARD_IN_PLAY] = self.in_play[i]
+
+        active = self.active[i]
+        board[c.BOARD_X][active] = self.position[i, active, 0]
+        board[c.BOARD_Y][active] = self.position[i, active, 1]
+
+        board_utils.update_distance_and_score(board)
+        return board
+
+    def getBoards(self) -> np.array:
+        return np.array([self.getBoard(i) for i in range(len(self))])
+
+    def moving(self) -> np.array:
+        """Per-board flag: is any stone on the ice still moving."""
+        fast = (np.abs(self.velocity) > MOVING_VELOCITY).any(axis=-1)
+        return (fast & self.active).any(axis=-1)
+
+    def run(self, deltaTime=c.DT):
+        sim_time = 0
+        running = self.moving()
+        log.debug('run starting with %s moving boards...', running.sum())
+        while running.any():
+            idx = np.flatnonzero(running)
+            self.step(idx, deltaTime)
+
+            violation = self.five_rock_rule_violation[idx]
+            if violation.any():
+                self._resetViolations(idx[violation])
+
+            sim_time += deltaTime
+            if sim_time > 60:
+                log.error('Simulation running for more than 60 seconds.')
+                raise simulation.Timeout()
+            running[idx] = self.moving()[idx] & ~violation
+
+    def step(self, idx: np.array, dt: float):
+        """Advance boards `idx` by one step in the same order as `pymunk.Space.step`."""
+        active = self.active[idx]
+        position = self.position[idx]
+        velocity = self.velocity[idx]
+        spin = self.spin[idx]
+
+        # 1. Integrate positions
+        position += velocity * dt * active[..., None]
+
+        # 2. Walls remove stones on contact
+        self._collideWalls(idx, position, active)
+
+        # 3. Integrate velocities (utils.stone_velocity)
+        speed = np.hypot(velocity[..., 0], velocity[..., 1])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            friction = np.where(speed > 0, -FRICTION_ACCEL * np.minimum(speed, 1) / speed, 0)
+        accel = velocity * friction[..., None] - curl_acceleration(velocity, speed, spin)
+        velocity += accel * dt * active[..., None]
+
+        damped = np.abs(spin) > ANGULAR_DAMPING
+        spin = np.where(damped, spin - ANGULAR_DAMPING * np.where(spin > 0, 1, -1), 0)
+
+        # 4. Stone-stone impulses
+        self._collideStones(position, velocity, spin, active)
+
+        self.position[idx] = position
+        self.velocity[idx] = velocity
+        self.spin[idx] = spin
+
+    def _collideWalls(self, idx, position, active):
+        reach = utils.STONE_RADIUS + WALL_RADIUS
+        x, y = position[..., 0], position[..., 1]
+        touching = active & (
+            (x - WALL_LEFT < reach) | (WALL_RIGHT - x < reach) | (WALL_BACK - y < reach)
+        )
+        if not touching.any():
+            return
+
+        # 5-rock rule: the opponent's guards can't be removed during the first 5 stones.
+        early = self.thrown[idx].sum(axis=-1) <= 5
+        opponent = _TEAM[None, :] != self.shooter_team[idx, None]
+        protected = touching & early[:, None] & opponent & self.guard[idx]
+        self.five_rock_rule_violation[idx] |= protected.any(axis=-1)
+
+        removed = touching & ~protected
+        active &= ~removed
+        in_play = self.in_play[idx]
+        in_play[removed] = c.OUT_OF_PLAY
+        self.in_play[idx] = in_play
+        self.active[idx] = active
+        log.debug('Removed %s stones on wall contact', removed.sum())
+
+    @staticmethod
+    def _collideStones(position, velocity, spin, active):
+        radius = utils.STONE_RADIUS
+        # Resting stones can't approach each other, so only test stones in motion against the rest.
+        moving = active & (velocity != 0).any(axis=-1)
+        b, i = np.nonzero(moving)
+        delta = position[b] - position[b, i][:, None, :]  # i -> j
+        distance = np.hypot(delta[..., 0], delta[..., 1])
+        near = active[b] & (distance < 2 * radius)
+        near[np.arange(len(b)), i] = False
+        near &= ~moving[b] | (_STONE_IDS[None, :] > i[:, None])  # each moving pair once
+        if not near.any():
+            return
+
+        k, j = np.nonzero(near)
+        b, i = b[k], i[k]
+        n = delta[k, j] / distance[k, j, None]
+        t = np.stack((-n[:, 1], n[:, 0]), axis=-1)
+
+        inv_mass = 2.0 / BODY_MASS
+        tangent_mass = inv_mass + 2 * radius ** 2 / BODY_MOMENT
+        for _ in range(SOLVER_ITERATIONS):
+            # Velocity of the contact point on j relative to i; spin moves i's surface by +R*w*t, j's by -R*w*t.
+            relative = velocity[b, j] - velocity[b, i] - t * (radius * (spin[b, i] + spin[b, j]))[:, None]
+            vn = (relative * n).sum(axis=-1)
+            approaching = vn < 0
+            if not approaching.any():
+                break
+            jn = np.where(approaching, -(1 + ELASTICITY) * vn / inv_mass, 0)
+            vt = (relative * t).sum(axis=-1)
+            jt = np.clip(-vt / tangent_mass, -FRICTION * jn, FRICTION * jn)
+
+            impulse = n * jn[:, None] + t * jt[:, None]
+            np.add.at(velocity, (b, i), -impulse / BODY_MASS)
+            np.add.at(velocity, (b, j), impulse / BODY_MASS)
+            np.add.at(spin, (b, i), -radius * jt / BODY_MOMENT)
+            np.add.at(spin, (b, j), -radius * jt / BODY_MOMENT)
+
+    def _resetViolations(self, idx: np.array):
+        """Same as `Simulation.addShooterAsInvalid` after a 5-rock violation."""
+        log.debug('Warning: 5 rock rule violated on %s boards. Resetting them!', len(idx))
+        for i in idx:
+            shooter = self.shooter[i]
+            before = self.boards_before_action[i]
+            self.thrown[i] = before[c.BOARD_THROWN]
+            self.in_play[i] = before[c.BOARD_IN_PLAY]
+            self.active[i] = (self.thrown[i] == c.THROWN) & (self.in_play[i] == c.IN_PLAY)
+            self.position[i] = np.stack((before[c.BOARD_X], before[c.BOARD_Y]), axis=-1)
+            self.position[i, ~self.active[i]] = 0
+            self.velocity[i] = 0
+            self.spin[i] = 0
+
+            self.thrown[i, shooter] = c.THROWN
+            self.in_play[i, shooter] = c.OUT_OF_PLAY
+            self.active[i, shooter] = False
+        self.five_rock_rule_violation[idx] = False
@@ -0,0 +1,49 @@
+"""
+Compares the physics backends of CurlingGame: seconds per shot for one shot at
+a time (getNextState, what MCTS and Coach call) and for every action from one
+board at once (getNextStates). No caches and no trajectory table.
+
+    python -m curling.benchmark_physics --actions 61
+"""
+import argparse
+import time
+
+import numpy as np
+
+from curling import board as board_utils
+from curling import constants as c
+from curling import game
+
+
+def perShot(simulate, actions):
+    """Seconds per shot of simulate(actions), best of 3 rounds."""
+    rounds = []
+    for _ in range(3):
+        start = time.perf_counter()
+        simulate(actions)
+        rounds.append((time.perf_counter() - start) / len(actions))
+    return min(rounds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--actions', type=int, default=61, help='Actions simulated from the board')
+    args = parser.parse_args()
+
+    # The hammer 2 end with the last stone still to throw: 15 stones on the ice.
+    board = board_utils.getInitBoard()
+    board_utils.configure_hammer_2_scenario(board)
+    board_utils.set_stone(board, c.P2, 7, 0, 0, c.NOT_THROWN, c.IN_PLAY)
+    player = c.P2
+    actions = np.linspace(0, len(c.ACTION_LIST) - 1, args.actions).astype(int).tolist()
+
+    print(f'{"physics":8} {"getNextState ms/shot":>21} {"getNextStates ms/shot":>22}')
+    for physics in game.PHYSICS_BACKENDS:
+        curl = game.CurlingGame(physics=physics)
+        one = perShot(lambda a: [curl.getNextState(board, player, action, use_cache=False) for action in a], actions)
+        batch = perShot(lambda a: curl.getNextStates(board, player, a), actions)
+        print(f'{physics:8} {one * 1e3:21.1f} {batch * 1e3:22.1f}')
+
+
+if __name__ == '__main__':
+    main()
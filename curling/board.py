@@ -1,3 +1,4 @@
+import hashlib
 from typing import Tuple, Generator
 
 import numpy as np
@@ -100,6 +101,47 @@ def getBoardSize():
     return 6, 16
 
 
+def getStateKey(board: np.array, tolerance: float = c.STATE_KEY_TOLERANCE) -> bytes:
+    """
+    Fixed-size (16 byte) key for hashing board states. Positions are quantized to `tolerance` inches. Distance and
+    scoring rows are derived from the positions, so they're left out.
+    """
+    positions = np.rint(board[c.BOARD_X:c.BOARD_Y + 1] / tolerance).astype(np.int64)
+    flags = board[c.BOARD_THROWN:c.BOARD_IN_PLAY + 1].astype(np.int8)
+    return hashlib.blake2b(positions.tobytes() + flags.tobytes(), digest_size=16).digest()
+
+
+def getTransposition(board: np.array, tolerance: float = c.STATE_KEY_TOLERANCE) -> Tuple[np.array, np.array, bool]:
+    """
+    Canonical representative of the boards equal to `board` up to reordering each team's thrown stones and mirroring
+    over the center line. Thrown stones are sorted in-play first, then by quantized y and x. The mirror image is used
+    if it sorts lower.
+
+    Returns (transposed, order, mirrored) where transposed = board[:, order], with x negated if mirrored.
+    """
+    qx = np.rint(board[c.BOARD_X] / tolerance).astype(np.int64)
+    qy = np.rint(board[c.BOARD_Y] / tolerance).astype(np.int64)
+    in_play = board[c.BOARD_IN_PLAY] == c.IN_PLAY
+
+    candidates = []
+    for x in (qx, -qx):
+        order = np.arange(16)
+        for team in (slice(0, 8), slice(8, 16)):
+            thrown = np.flatnonzero(board[c.BOARD_THROWN][team] == c.THROWN) + team.start
+            order[thrown] = thrown[np.lexsort((x[thrown], qy[thrown], ~in_play[thrown]))]
+        candidates.append((order, np.concatenate((~in_play[order], qy[order], x[order]))))
+
+    (order, plain), (mirror_order, mirror) = candidates
+    differ = np.flatnonzero(plain != mirror)
+    mirrored = bool(differ.size) and mirror[differ[0]] < plain[differ[0]]
+    if mirrored:
+        order = mirror_order
+    transposed = board[:, order]
+    if mirrored:
+        transposed[c.BOARD_X] *= -1
+    return transposed, order, mirrored
+
+
 def getBoardRepr(board):
     ret = "\n"
     ret += str(list(map(int, board[0]))) + "\n"
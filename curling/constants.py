@@ -1,4 +1,7 @@
+import hashlib
+import importlib
 import os
+import types
 from typing import Tuple
 
 import pymunk
@@ -12,8 +15,11 @@ def dist(inches=0., feet=0., meters=0.):
 
 
 script_dir = os.path.dirname(__file__)
+SHARED_CONSTANTS_FILE = script_dir + '/shared_constants.yaml'
+TRAJECTORY_FILE = script_dir + '/trajectories.npz'
+SHOT_CACHE_FILE = script_dir + '/shot_cache.sqlite3'
 
-with open(script_dir + '/shared_constants.yaml') as sc_file:
+with open(SHARED_CONSTANTS_FILE) as sc_file:
     sc = yaml.load(sc_file, Loader=yaml.Loader)
 
     STONE_RADIUS_IN = sc['STONE_RADIUS_IN']
@@ -51,6 +57,7 @@ BOARD_DISTANCE = 4
 BOARD_SCORING = 5
 
 DT = 0.016  # Simulation deltaTime
+STATE_KEY_TOLERANCE = 0.01  # inches. Stones closer than this are the same state for MCTS and the shot caches.
 WEIGHT_FT = {
     #    '1': 108,
     #    '2': 112,
@@ -86,3 +93,59 @@ SHORT_ACTION_LIST = [
 
 # TODO: Move all constants from utils here.
 BUTTON_POSITION = pymunk.Vec2d(0, dist(feet=124.5))
+
+
+# Modules (in curling) with the code and parameters of each physics backend (CurlingGame.physics).
+PHYSICS_MODULES = {
+    'pymunk': ('utils', 'simulation'),
+    'numpy': ('utils', 'simulation', 'batch_simulation'),
+}
+
+
+def physics_hash(backend) -> str:
+    """
+    Fingerprint of everything that changes shot outcomes of a physics backend. Use it to invalidate stored physics
+    results. Covers the shared constants, the backend's name, and the compiled functions and upper case parameters of
+    its modules: editing their code invalidates results, editing comments or docstrings doesn't.
+    """
+    digest = hashlib.sha1()
+    with open(SHARED_CONSTANTS_FILE, 'rb') as f:
+        digest.update(f.read())
+    digest.update(repr((DT, ACTION_LIST)).encode())
+    digest.update(backend.encode())
+    for name in PHYSICS_MODULES[backend]:
+        module = importlib.import_module(f'curling.{name}')
+        for key, value in sorted(vars(module).items()):
+            if key.isupper():
+                digest.update(f'{key}={_parameterBytes(value)!r}'.encode())
+            elif getattr(value, '__module__', None) == module.__name__:
+                _fingerprintObject(value, digest)
+    return digest.hexdigest()
+
+
+def _parameterBytes(value):
+    return value.tobytes() if hasattr(value, 'tobytes') else repr(value)
+
+
+def _fingerprintObject(value, digest):
+    """Adds the code of a function, or of the methods of a class, to digest."""
+    if isinstance(value, type):
+        for _, member in sorted(vars(value).items()):
+            _fingerprintObject(getattr(member, '__func__', getattr(member, 'fget', member)), digest)
+    elif isinstance(value, types.FunctionType):
+        code = value.__code__
+        consts = code.co_consts[1:] if value.__doc__ is not None and code.co_consts[:1] == (value.__doc__,) \
+            else code.co_consts
+        _fingerprintCode(code, consts, digest)
+
+
+def _fingerprintCode(code, consts, digest):
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for const in consts:
+        if isinstance(const, types.CodeType):
+            _fingerprintCode(const, const.co_consts, digest)
+        elif isinstance(const, frozenset):  # iterates in hash order, which changes between processes
+            digest.update(repr(sorted(const, key=repr)).encode())
+        else:
+            digest.update(repr(const).encode())
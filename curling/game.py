@@ -4,29 +4,73 @@ import logging
 import memoization as mem
 import numpy as np
 
+from curling import batch_simulation
 from curling import board as board_utils
 from curling import constants as c
+from curling import shot_cache
 from curling import simulation
+from curling import trajectories
 from curling import utils
 
 log = logging.getLogger(__name__)
 
 _TIED_SCORE = 0.00001
 
+PHYSICS_PYMUNK = 'pymunk'
+PHYSICS_NUMPY = 'numpy'
+PHYSICS_BACKENDS = (PHYSICS_PYMUNK, PHYSICS_NUMPY)
+
+_IDENTITY_ACTIONS = np.arange(len(c.ACTION_LIST))
+_MIRRORED_ACTIONS = np.array([utils.mirrorAction(a) for a in _IDENTITY_ACTIONS])
+
 
 class GameException(Exception):
     """Logic within game is broken."""
 
 
 class CurlingGame:
-
-    def __init__(self):
-        self.sim = simulation.Simulation()
-        self.caches = []
+    """
+    physics picks the backend that simulates shots. 'numpy' only pays off for
+    many shots at once: getNextStates from one board, and building the
+    trajectory table. One shot at a time, through getNextState as MCTS and
+    Coach call it, it is about 2x slower than 'pymunk' (see
+    curling/benchmark_physics.py).
+    """
+
+    def __init__(self, physics=PHYSICS_PYMUNK, use_trajectories=False, shot_cache_file=None, use_transpositions=False):
+        if physics not in PHYSICS_BACKENDS:
+            raise GameException(f'Unknown physics backend: {physics}. Expected one of {PHYSICS_BACKENDS}')
+        self.physics = physics
+        # Shots with nothing in their path are placed from a precomputed table instead of simulated.
+        self.trajectories = trajectories.TrajectoryTable.load() if use_trajectories else None
+        self.sim = simulation.Simulation(trajectories=self.trajectories)
+        self.batch_sim = batch_simulation.BatchSimulation()
+        # Shot outcomes shared with other processes and runs, behind the in-memory caches.
+        self.shot_cache = shot_cache.ShotCache(physics, shot_cache_file) if shot_cache_file else None
+        # Reordered and mirrored boards share cache entries and MCTS nodes.
+        self.use_transpositions = use_transpositions
+        self.caches = self._newCaches()
+
+    def __getstate__(self):
+        # Simulations and caches stay behind. Each process (e.g. a self-play worker) builds its own.
+        state = self.__dict__.copy()
+        for name in ('sim', 'batch_sim', 'caches'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.sim = simulation.Simulation(trajectories=self.trajectories)
+        self.batch_sim = batch_simulation.BatchSimulation()
+        self.caches = self._newCaches()
+
+    def _newCaches(self):
+        caches = []
         for _ in range(16):
             new_cache = mem.cached(algorithm=mem.LFU, max_size=len(c.ACTION_LIST) ** 2,
-                                   custom_key_maker=self._custom_keys)(self.getNextState)
-            self.caches.append(new_cache)
+                                   custom_key_maker=self._custom_keys)(self._getNextStateShared)
+            caches.append(new_cache)
+        return caches
 
     @classmethod
     def getBoardSize(cls):
@@ -42,7 +86,7 @@ class CurlingGame:
     def _custom_keys(self, board, player, action, use_cache=True):
         log.debug('_custom_keys called')
         log.debug('%s, %s, %s', board, player, action)
-        return np.array2string(board, precision=5), player, action
+        return board_utils.getStateKey(board), player, action
 
     def getNextState(self, board, player, action, use_cache=True):
         log.debug(f'getNextState({self.stringRepresentation(board)}, {player}, {action}={utils.decodeAction(action)})')
@@ -53,12 +97,74 @@ class CurlingGame:
             flip = player == c.P2
             canon = self.getCanonicalForm(board, player)
             cache = self.caches[cache_idx]
+            if self.use_transpositions:
+                canon, order, mirrored = board_utils.getTransposition(canon)
+                if mirrored:
+                    action = utils.mirrorAction(action)
             next_board, next_player = cache(canon, c.P1, action, use_cache=False)
+            if self.use_transpositions:
+                next_board = next_board.copy()
+                if mirrored:
+                    next_board[c.BOARD_X] *= -1
+                next_board[:, order] = next_board.copy()
             if flip:
                 next_board = self.getCanonicalForm(next_board, c.P2)
                 next_player = c.P1
             return next_board, next_player
 
+        if self.trajectories is not None and self.trajectories.isClear(board, action):
+            log.debug('Path is clear. Placing shooter from the trajectory table.')
+            next_board = self.trajectories.getNextBoard(board, player, action)
+        elif self.physics == PHYSICS_NUMPY:
+            next_board = self._simulateNumpy(board, player, action)
+        else:
+            next_board = self._simulatePymunk(board, player, action)
+        next_player = -player
+
+        if board_utils.thrownStones(next_board) < 16:
+            np_check = utils.getNextPlayer(next_board, next_player)
+            if next_player != np_check:
+                raise GameException('Next player check failed.')
+
+        return next_board, next_player
+
+    def getNextStates(self, board, player, actions):
+        """
+        Simulate every action in `actions` from the same board and stack the results into an array of shape
+        (len(actions), 6, 16). The next player is -player for all of them. Results are not cached.
+        """
+        log.debug(f'getNextStates({self.stringRepresentation(board)}, {player}, {len(actions)} actions)')
+        assert board_utils.thrownStones(board) < 16
+
+        next_boards = np.empty((len(actions),) + self.getBoardSize())
+        simulated = list(range(len(actions)))
+        if self.trajectories is not None:
+            simulated = []
+            for i, action in enumerate(actions):
+                if self.trajectories.isClear(board, action):
+                    next_boards[i] = self.trajectories.getNextBoard(board, player, action)
+                else:
+                    simulated.append(i)
+        if not simulated:
+            return next_boards
+
+        if self.physics == PHYSICS_NUMPY:
+            self.batch_sim.setupBoards(np.repeat(board[None], len(simulated), axis=0))
+            self.batch_sim.setupActions(player, [actions[i] for i in simulated])
+            self.batch_sim.run()
+            next_boards[simulated] = self.batch_sim.getBoards()
+            return next_boards
+
+        self.sim.setupBoard(board)
+        snapshot = self.sim.getSnapshot()
+        for i in simulated:
+            self.sim.restoreSnapshot(snapshot)
+            self.sim.setupAction(player, actions[i])
+            self.sim.run()
+            next_boards[i] = self.sim.getBoard()
+        return next_boards
+
+    def _simulatePymunk(self, board, player, action):
         self.sim.setupBoard(board)
 
         totalThrownStones_before = self.sim.space.thrownStonesCount()
@@ -67,14 +173,30 @@ class CurlingGame:
         self.sim.run()
         assert totalThrownStones_before + 1 == self.sim.space.thrownStonesCount(), f"Thrown stone count didn't increase correctly. before: {totalThrownStones_before}. now: {self.sim.space.thrownStonesCount()}"
 
-        next_board = self.sim.getBoard()
-        next_player = -player
+        return self.sim.getBoard()
 
-        if self.sim.space.thrownStonesCount() < 16:
-            np_check = utils.getNextPlayer(next_board, next_player)
-            if next_player != np_check:
-                raise GameException('Next player check failed.')
+    def _simulateNumpy(self, board, player, action):
+        totalThrownStones_before = board_utils.thrownStones(board)
+        assert totalThrownStones_before < 16
+        self.batch_sim.setupBoards(board[None])
+        self.batch_sim.setupActions(player, action)
+        self.batch_sim.run()
+        next_board = self.batch_sim.getBoard(0)
+        assert totalThrownStones_before + 1 == board_utils.thrownStones(next_board), f"Thrown stone count didn't increase correctly. before: {totalThrownStones_before}. now: {board_utils.thrownStones(next_board)}"
+
+        return next_board
+
+    def _getNextStateShared(self, board, player, action, use_cache=True):
+        """getNextState through the on-disk shot cache, if there is one."""
+        if self.shot_cache is None:
+            return self.getNextState(board, player, action, use_cache=False)
 
+        next_board = self.shot_cache.get(board, action)
+        if next_board is not None:
+            return next_board, -player
+
+        next_board, next_player = self.getNextState(board, player, action, use_cache=False)
+        self.shot_cache.put(board, action, next_board)
         return next_board, next_player
 
     def getValidMoves(self, board, player):
@@ -135,13 +257,32 @@ class CurlingGame:
         CurlingGame._permuate_symmetries(all_symmetries, board, pi, 0, 8)
         CurlingGame._permuate_symmetries(all_symmetries, board, pi, 8, 16)
 
+        flip_pi = np.asarray(pi)[_MIRRORED_ACTIONS]  # the mirrored board's policy is the mirrored shots'
         for i in range(len(all_symmetries)):
             s_board, _ = all_symmetries[i]
             flip = s_board.copy()
             flip[c.BOARD_X] *= -1  # vertical symmetry over center line
-            all_symmetries.append((flip, pi))
+            all_symmetries.append((flip, flip_pi))
         return all_symmetries
 
+    @staticmethod
+    def getRandomSymmetries(boards: np.array, pis: np.array):
+        """
+        A random one of getSymmetries for every example of a batch: thrown stones shuffled within each team, and
+        mirrored half of the time, with pi mirrored along.
+        """
+        thrown = boards[:, c.BOARD_THROWN] != c.NOT_THROWN
+        team = np.arange(16) // 8
+        # Sorting keeps each team in its own columns and stones not thrown yet last, in their order.
+        keys = np.where(thrown, np.random.random(thrown.shape), 1 + np.arange(16) / 16) + 2 * team
+        boards = np.take_along_axis(boards, np.argsort(keys)[:, None, :], axis=2)
+
+        pis = pis.copy()
+        mirrored = np.random.random(len(boards)) < 0.5
+        boards[mirrored, c.BOARD_X] *= -1
+        pis[mirrored] = pis[mirrored][:, _MIRRORED_ACTIONS]
+        return boards, pis
+
     @staticmethod
     def _permuate_symmetries(all_symmetries, board, pi, start, stop):
         log.debug('Permuating symmetries!')
@@ -159,6 +300,16 @@ class CurlingGame:
                 swap[:, [i, i2]] = swap[:, [i2, i]]
                 all_symmetries.append((swap, pi))
 
+    def getTransposition(self, board: np.array):
+        if not self.use_transpositions:
+            return board, _IDENTITY_ACTIONS
+        transposed, _, mirrored = board_utils.getTransposition(board)
+        return transposed, _MIRRORED_ACTIONS if mirrored else _IDENTITY_ACTIONS
+
+    @staticmethod
+    def stateKey(board: np.array) -> bytes:
+        return board_utils.getStateKey(board)
+
     @staticmethod
     def stringRepresentation(board: np.array):
         return json.dumps(np.around(board, decimals=2).tolist())
@@ -0,0 +1,89 @@
+"""
+Shot outcomes shared across processes and runs.
+
+`ShotCache` stores (board, action) -> next board in an SQLite file opened in WAL mode, so any number of self-play,
+arena or client processes can read and append to it at the same time. Every entry is tagged with
+`constants.physics_hash(backend)`; entries simulated with different physics, another backend or another version of
+its code are never returned.
+"""
+import logging
+import os
+import sqlite3
+
+import numpy as np
+
+from curling import board as board_utils
+from curling import constants as c
+
+log = logging.getLogger(__name__)
+
+_BOARD_DTYPE = np.float64
+
+
+class ShotCache:
+
+    def __init__(self, backend, filename=c.SHOT_CACHE_FILE, timeout=30.0):
+        self.filename = filename
+        self.timeout = timeout
+        self.physics = c.physics_hash(backend)
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+
+    def __getstate__(self):
+        # Connections can't cross processes. Each process opens its own on first use.
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            folder = os.path.dirname(self.filename)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            self._connection = sqlite3.connect(self.filename, timeout=self.timeout, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS shots ('
+                ' physics TEXT NOT NULL, key BLOB NOT NULL, action INTEGER NOT NULL, board BLOB NOT NULL,'
+                ' PRIMARY KEY (physics, key, action))')
+        return self._connection
+
+    def get(self, board: np.array, action: int):
+        """Next board for `action` from `board`, or None."""
+        row = self.connection.execute(
+            'SELECT board FROM shots WHERE physics = ? AND key = ? AND action = ?',
+            (self.physics, board_utils.getStateKey(board), int(action))).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return np.frombuffer(row[0], dtype=_BOARD_DTYPE).reshape(board_utils.getBoardSize()).copy()
+
+    def put(self, board: np.array, action: int, next_board: np.array):
+        self.connection.execute(
+            'INSERT OR IGNORE INTO shots (physics, key, action, board) VALUES (?, ?, ?, ?)',
+            (self.physics, board_utils.getStateKey(board), int(action), next_board.astype(_BOARD_DTYPE).tobytes()))
+
+    def purge(self) -> int:
+        """Delete entries simulated with other physics. Returns number of entries deleted."""
+        return self.connection.execute('DELETE FROM shots WHERE physics != ?', (self.physics,)).rowcount
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM shots WHERE physics = ?', (self.physics,)).fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self),
+        }
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
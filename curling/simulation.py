@@ -50,21 +50,52 @@ def getNextStoneOrderId(board) -> int:
     log.error('Id requested for 9th rock.')
     raise SimulationException()
 
+def _newStone(slot: int) -> utils.Stone:
+    stone = utils.newStone(c.P1_COLOR if slot < 8 else c.P2_COLOR)
+    stone.id = slot % 8
+    return stone
+
+
+def _getSlot(stone: utils.Stone) -> int:
+    return stone.id if stone.color == c.P1_COLOR else stone.id + 8
+
+
+def _placeStone(stone: utils.Stone, x, y):
+    """Reset a pooled stone to rest at (x, y)."""
+    stone.body.position = x, y
+    stone.body.velocity = utils.ZERO_VECTOR
+    stone.body.angular_velocity = 0
+    stone.body.angle = 0
+    stone.is_shooter = False
+    stone.already_removed = False
+    stone.updateGuardValue()
+
+
 class Simulation:
 
-    def __init__(self):
+    def __init__(self, trajectories=None):
         space = utils.Space(threaded=True)
         space.threads = 2
         space.gravity = 0, 0
         space.damping = 1  # No slow down percentage
 
         utils.addBoundaries(space)
+        utils.trackStoneContacts(space)
 
         self.space = space
 
+        # One stone per board slot (p1 0-7, p2 8-15), reused for every board. The shooter is the stone of its slot.
+        self.stones = [_newStone(slot) for slot in range(16)]
+
         self.space.thrown_stones = [c.NOT_THROWN] * 16
         self.space.inplay_stones = [c.IN_PLAY] * 16
 
+        # Optional trajectories.TrajectoryTable used by run() to jump the shooter ahead to its first contact.
+        self.trajectories = trajectories
+        self.shooter_action = None
+        self.steps_run = 0
+        self.steps_skipped = 0
+
         self.resetBoard()
         self.board_before_action = self.getBoard()
 
@@ -94,28 +125,58 @@ class Simulation:
     def setupBoard(self, new_board):
         new_board = new_board.copy()
         log.debug(f'setupBoard({board_utils.getBoardRepr(new_board)})')
-        self.resetBoard()
 
-        p1_stones = board_utils.stones_for_team(new_board, c.P1)
-        for i, (x, y, thrown, in_play, *_) in enumerate(p1_stones):
-            if thrown and in_play:
-                self.addStone(c.P1_COLOR, x, y, stone_id=i)
-
-        p2_stones = board_utils.stones_for_team(new_board, c.P2)
-        for i, (x, y, thrown, in_play, *_) in enumerate(p2_stones):
-            if thrown and in_play:
-                self.addStone(c.P2_COLOR, x, y, stone_id=i)
+        on_board = (new_board[c.BOARD_THROWN] == c.THROWN) & (new_board[c.BOARD_IN_PLAY] == c.IN_PLAY)
+        self._loadStones({
+            slot: (new_board[c.BOARD_X][slot], new_board[c.BOARD_Y][slot]) for slot in np.flatnonzero(on_board)
+        })
 
         # TODO: Convert all p1/p2_removed_stones to single array. maybe
         self.space.thrown_stones = new_board[c.BOARD_THROWN]
         self.space.inplay_stones = new_board[c.BOARD_IN_PLAY]
 
+    def getSnapshot(self):
+        """Remember the stones on the ice so several shots can be run from the same board."""
+        positions = {_getSlot(stone): stone.getXY() for stone in self.getStones()}
+        return positions, list(self.space.thrown_stones), list(self.space.inplay_stones)
+
+    def restoreSnapshot(self, snapshot):
+        """Put the stones back where `getSnapshot` found them."""
+        positions, thrown_stones, inplay_stones = snapshot
+        self._loadStones(positions)
+
+        self.space.thrown_stones = list(thrown_stones)
+        self.space.inplay_stones = list(inplay_stones)
+        self.space.five_rock_rule_violation = False
+
     def resetBoard(self):
-        for stone in self.getStones():
-            self.space.remove(stone.body, stone)
+        self._loadStones({})
         self.space.thrown_stones = [c.NOT_THROWN] * 16
         self.space.inplay_stones = [c.IN_PLAY] * 16
 
+    def _loadStones(self, positions):
+        """Place pooled stones at `positions` ({slot: (x, y)}, slots 0-15) at rest and take the others off the ice."""
+        on_ice = set(self.getStones())
+        for stone in self.space.touched_stones:
+            # chipmunk keeps solver state for bodies that were in contact (cached contacts, bias velocity) that can't
+            # be reset, so those get a fresh stone to keep each shot independent of the one simulated before it.
+            if stone in on_ice:
+                self.space.remove(stone.body, stone)
+                on_ice.discard(stone)
+            slot = _getSlot(stone)
+            self.stones[slot] = _newStone(slot)
+        self.space.touched_stones.clear()
+
+        for slot, stone in enumerate(self.stones):
+            if slot not in positions:
+                if stone in on_ice:
+                    self.space.remove(stone.body, stone)
+                continue
+
+            _placeStone(stone, *positions[slot])
+            if stone not in on_ice:
+                self.space.add(stone.body, stone)
+
     def getStones(self) -> List[utils.Stone]:
         # keeping it a list (not an iterator) on purpose
         return [s for s in self.space.shapes if type(s) == utils.Stone]
@@ -131,14 +192,14 @@ class Simulation:
         raise ShooterNotFound()
 
     def addStone(self, color: str, x, y, action=None, stone_id=None):
-        stone = utils.newStone(color)
-        board = self.getBoard()
         if stone_id is None:
-            stone_id = getNextStoneId(board)
-        stone.id = stone_id
+            stone_id = getNextStoneId(self.getBoard())
+        data_position = stone_id if color == c.P1_COLOR else stone_id + 8
 
-        stone.body.position = x, y
-        stone.updateGuardValue()
+        stone = self.stones[data_position]
+        if stone in self.getStones():
+            self.space.remove(stone.body, stone)
+        _placeStone(stone, x, y)
 
         if action is not None:
             handle, weight, broom = utils.decodeAction(action)
@@ -148,14 +209,10 @@ class Simulation:
 
             log.debug(f'Setting HWB: {handle, weight, broom}')
             log.debug(f'Velocity: {stone.body.velocity}')
-        else:
-            stone.body.angular_velocity = 0
-            stone.body.velocity = utils.ZERO_VECTOR
 
-        log.debug("+ %s" % stone)
+        log.debug('+ %s', stone)
         self.space.add(stone.body, stone)
 
-        data_position = stone_id if color == c.P1_COLOR else stone_id + 8
         self.space.thrown_stones[data_position] = c.THROWN
         self.space.inplay_stones[data_position] = c.IN_PLAY
         return stone
@@ -166,6 +223,7 @@ class Simulation:
         color = utils.getPlayerColor(player)
         self.addStone(color, 0, 0, action)
         self.space.shooter_color = color
+        self.shooter_action = action
 
     def addShooterAsInvalid(self):
         # Convert removed_stones variable to something else.
@@ -180,12 +238,45 @@ class Simulation:
         self.space.thrown_stones[data_position] = c.THROWN
         self.space.inplay_stones[data_position] = c.OUT_OF_PLAY
 
+    def fastForward(self, deltaTime=c.DT) -> int:
+        """
+        Move a freshly thrown shooter along its precomputed empty-ice path up to the step before it may touch another
+        stone or a wall. Everything else is at rest until then, so the result is the same as stepping.
+
+        Only the shooter's run-up to its first contact is skipped: from there on, run steps every stone, including
+        stones sliding freely after the collision.
+
+        Returns number of steps skipped.
+        """
+        action, self.shooter_action = self.shooter_action, None
+        if self.trajectories is None or action is None or deltaTime != c.DT:
+            return 0
+
+        shooter = self.getShooterStone()
+        others = [s for s in self.getStones() if s is not shooter]
+        if any(s.moving() for s in others):
+            return 0
+
+        stones = np.array([s.getXY() for s in others]).reshape(-1, 2)
+        steps = self.trajectories.getFreeSteps(action, stones)
+        if steps == 0:
+            return 0
+
+        shooter.body.position = tuple(self.trajectories.paths[action][steps])
+        shooter.body.velocity = tuple(self.trajectories.velocities[action][steps])
+        shooter.body.angular_velocity = float(self.trajectories.spins[action][steps])
+        shooter.body.angle = float(np.sum(self.trajectories.spins[action][:steps])) * deltaTime
+        return steps
+
     def run(self, deltaTime=c.DT):
+        self.steps_skipped = self.fastForward(deltaTime)
+        self.steps_run = 0
         more_changes = True
-        sim_time = 0
+        sim_time = self.steps_skipped * deltaTime
         log.debug('run starting...')
         while more_changes:
             self.space.step(deltaTime)
+            self.steps_run += 1
 
             if self.space.five_rock_rule_violation:
                 # TODO: Move this logic to game.getNextState()
@@ -201,4 +292,5 @@ class Simulation:
                 raise Timeout()
             more_changes = any(s.moving() for s in self.space.get_stones())
 
+        log.debug('run() complete in %s steps (%s skipped)', self.steps_run, self.steps_skipped)
         log.debug('run() complete with stones: %s and data: %s', self.getStones(), self.getBoard())
@@ -0,0 +1,100 @@
+import numpy as np
+
+import log_handler
+from curling import batch_simulation
+from curling import board as board_utils
+from curling import constants as c
+from curling import game
+from curling import utils
+
+log_handler.flush_on_error()
+
+_SAMPLE_ACTIONS = range(0, len(c.ACTION_LIST), 7)
+
+
+def _pymunk_boards(board, player, actions):
+    curl = game.CurlingGame()
+    return np.array([curl.getNextState(board, player, a, use_cache=False)[0] for a in actions])
+
+
+def _numpy_boards(board, player, actions):
+    sim = batch_simulation.BatchSimulation()
+    sim.setupBoards(np.repeat(board[None], len(actions), axis=0))
+    sim.setupActions(player, list(actions))
+    sim.run()
+    return sim.getBoards()
+
+
+def _position_error(expected, actual):
+    return np.abs(expected - actual)[:, [c.BOARD_X, c.BOARD_Y]].max(axis=(1, 2))
+
+
+def test_empty_ice_matches_pymunk():
+    board = board_utils.getInitBoard()
+
+    expected = _pymunk_boards(board, c.P1, _SAMPLE_ACTIONS)
+    actual = _numpy_boards(board, c.P1, _SAMPLE_ACTIONS)
+
+    assert _position_error(expected, actual).max() < batch_simulation.POSITION_TOLERANCE
+    flags = [c.BOARD_THROWN, c.BOARD_IN_PLAY, c.BOARD_SCORING]
+    np.testing.assert_array_equal(expected[:, flags], actual[:, flags])
+
+
+def test_collisions_match_pymunk():
+    board = board_utils.getInitBoard()
+    board_utils.configure_hammer_2_scenario(board)
+    board_utils.set_stone(board, c.P2, 7, 0, utils.TEE_LINE, thrown=c.NOT_THROWN)
+    board_utils.set_stone(board, c.P1, 0, -utils.dist(feet=2), utils.HOG_LINE + utils.dist(feet=5))
+
+    expected = _pymunk_boards(board, c.P2, _SAMPLE_ACTIONS)
+    actual = _numpy_boards(board, c.P2, _SAMPLE_ACTIONS)
+
+    within = _position_error(expected, actual) < batch_simulation.POSITION_TOLERANCE
+    assert np.mean(within) >= batch_simulation.COLLISION_AGREEMENT
+
+
+def test_boards_run_independently():
+    board = board_utils.getInitBoard()
+    actions = [utils.getAction(1, '5', 0), utils.getAction(-1, 'control', 6)]
+
+    actual = _numpy_boards(board, c.P1, actions)
+
+    assert actual[0][c.BOARD_IN_PLAY][0] == c.IN_PLAY
+    assert actual[1][c.BOARD_IN_PLAY][0] == c.OUT_OF_PLAY
+    assert actual[1][c.BOARD_X][0] == 0
+
+
+def test_5_rock_rule():
+    curl = game.CurlingGame(physics=game.PHYSICS_NUMPY)
+    board = curl.getInitBoard()
+
+    next_board, next_player = curl.getNextState(board, c.P1, utils.getAction(-1, '3', 5))
+    next_board, next_player = curl.getNextState(next_board, next_player, utils.getAction(-1, 'control', 0))
+    assert next_player == c.P1
+
+    assert len(list(board_utils.get_xy_team1(next_board))) == 1, "Player 1 should keep their stone."
+    assert len(list(board_utils.get_xy_team2(next_board))) == 0, "Player 2 should have had their stone removed."
+    assert next_board[c.BOARD_THROWN][8] == c.THROWN
+
+
+def test_game_uses_numpy_physics():
+    curl = game.CurlingGame(physics=game.PHYSICS_NUMPY)
+    board = curl.getInitBoard()
+
+    next_board, _ = curl.getNextState(board, c.P1, utils.getAction(1, '5', 0))
+
+    assert len(curl.sim.getStones()) == 0  # pymunk space untouched
+    np.testing.assert_almost_equal(
+        next_board[:, 0],
+        [70.3, 1450, 1, 1, 81.2, 1],
+        decimal=-1
+    )
+
+
+def test_unknown_physics():
+    try:
+        game.CurlingGame(physics='box2d')
+    except game.GameException:
+        pass
+    else:
+        raise Exception('Unknown physics backend should be rejected.')
@@ -38,4 +38,58 @@ def test_correct_stones_scoring_2():
 
   board.update_distance_and_score(b)
 
-  assert np.sum(b[c.BOARD_SCORING]) == 3
\ No newline at end of file
+  assert np.sum(b[c.BOARD_SCORING]) == 3
+
+def test_state_key_quantizes_positions():
+  b = board.getInitBoard()
+  b[c.BOARD_THROWN][0] = c.THROWN
+  b[c.BOARD_IN_PLAY][0] = c.IN_PLAY
+  b[c.BOARD_Y][0] = 1000.0
+  key = board.getStateKey(b)
+  assert len(key) == 16
+
+  nudged = b.copy()
+  nudged[c.BOARD_Y][0] += c.STATE_KEY_TOLERANCE / 10
+  assert board.getStateKey(nudged) == key
+
+  moved = b.copy()
+  moved[c.BOARD_Y][0] += c.STATE_KEY_TOLERANCE * 2
+  assert board.getStateKey(moved) != key
+  assert board.getStateKey(moved, tolerance=1) == board.getStateKey(b, tolerance=1)
+
+def test_state_key_ignores_derived_rows():
+  b = board.getInitBoard()
+  b[c.BOARD_THROWN][3] = c.THROWN
+  b[c.BOARD_IN_PLAY][3] = c.IN_PLAY
+  key = board.getStateKey(b)
+  board.update_distance_and_score(b)
+  assert board.getStateKey(b) == key
+
+  b[c.BOARD_IN_PLAY][3] = c.OUT_OF_PLAY
+  assert board.getStateKey(b) != key
+
+def test_transposition_merges_reordered_and_mirrored():
+  b = board.getInitBoard()
+  board.set_stone(b, c.P1, 0, 10, 1400)
+  board.set_stone(b, c.P1, 1, -20, 1300)
+  board.set_stone(b, c.P1, 2, 0, 0, in_play=c.OUT_OF_PLAY)
+  board.set_stone(b, c.P2, 0, 30, 1450)
+  board.set_stone(b, c.P2, 1, 5, 1500)
+
+  transposed, order, mirrored = board.getTransposition(b)
+  np.testing.assert_array_equal(np.sort(order[:8]), np.arange(8))
+
+  swapped = b.copy()
+  swapped[:, [0, 2]] = swapped[:, [2, 0]]
+  flipped = b.copy()
+  flipped[c.BOARD_X] *= -1
+  for other in (swapped, flipped):
+    other_transposed, _, other_mirrored = board.getTransposition(other)
+    np.testing.assert_array_equal(other_transposed, transposed)
+    assert board.getStateKey(other_transposed) == board.getStateKey(transposed)
+  assert board.getTransposition(flipped)[2] != mirrored
+
+  again, again_order, again_mirrored = board.getTransposition(transposed)
+  np.testing.assert_array_equal(again, transposed)
+  np.testing.assert_array_equal(again_order, np.arange(16))
+  assert not again_mirrored
@@ -1,3 +1,4 @@
+import pickle
 from unittest import mock
 
 import numpy as np
@@ -292,25 +293,51 @@ def test_getSymmetries_flip():
     board = curl.getInitBoard()
 
     board_utils.configure_hammer_2_scenario(board)
+    pi = np.random.random(curl.getActionSize())
 
-    sym = curl.getSymmetries(board, 0)
-    back = curl.getSymmetries(sym[-1][0], 0)
+    sym = curl.getSymmetries(board, pi)
+    back = curl.getSymmetries(*sym[-1])
 
     np.testing.assert_array_equal(board, back[-1][0])
+    np.testing.assert_array_equal(pi, back[-1][1])
+    flipped_pi = sym[-1][1]
+    for action in range(curl.getActionSize()):
+        assert flipped_pi[utils.mirrorAction(action)] == pi[action]
 
 
 def test_getSymmetries_count():
     curl = game.CurlingGame()
 
     board = curl.getInitBoard()
-    sym = curl.getSymmetries(board, 0)
+    pi = np.zeros(curl.getActionSize())
+    sym = curl.getSymmetries(board, pi)
     assert len(sym) == 2  # Regular and flip
 
     board_utils.configure_hammer_2_scenario(board)
-    sym = curl.getSymmetries(board, 0)
+    sym = curl.getSymmetries(board, pi)
     # 2 stones yield (14 - 1) permutations.
     assert len(sym) == 28  # (13 permutations + original) * 2 for flip
 
+
+def test_getRandomSymmetries_are_transpositions():
+    curl = game.CurlingGame(use_transpositions=True)
+    board = curl.getInitBoard()
+    board_utils.configure_hammer_2_scenario(board)
+    board_utils.set_stone(board, c.P1, 1, 10, utils.TEE_LINE)
+    pi = np.random.random(curl.getActionSize())
+    boards, pis = curl.getRandomSymmetries(np.repeat(board[None], 20, axis=0), np.repeat(pi[None], 20, axis=0))
+
+    transposed, action_map = curl.getTransposition(board)
+    expected = np.zeros_like(pi)
+    expected[action_map] = pi
+    for sym_board, sym_pi in zip(boards, pis):
+        sym_transposed, sym_action_map = curl.getTransposition(sym_board)
+        np.testing.assert_array_equal(sym_transposed, transposed)
+        sym_expected = np.zeros_like(sym_pi)
+        sym_expected[sym_action_map] = sym_pi
+        np.testing.assert_array_equal(sym_expected, expected)
+    assert len({sym_board.tobytes() for sym_board in boards}) > 1
+
 # NOTE: Commented out because it's really slow.
 # @mock.patch("curling.constants.ACTION_LIST", c.SHORT_ACTION_LIST)
 # def test_get_valid_moves_caches():
@@ -323,3 +350,85 @@ def test_getSymmetries_count():
 #
 #         curl.getValidMoves(board, 1)
 #         assert spy.call_count == 4  # Call count didn't increase!
+
+
+def test_getNextStates_matches_getNextState():
+    curl = game.CurlingGame()
+    board = curl.getInitBoard()
+    board_utils.configure_hammer_2_scenario(board)
+    board_utils.set_stone(board, c.P2, 7, 0, 0, c.NOT_THROWN, c.IN_PLAY)
+    actions = [utils.getAction(-1, '3', 5), utils.getAction(1, '5', 0), utils.getAction(-1, 'control', 6)]
+
+    next_boards = curl.getNextStates(board, c.P2, actions)
+
+    assert next_boards.shape == (len(actions), 6, 16)
+    for action, next_board in zip(actions, next_boards):
+        expected, _ = curl.getNextState(board, c.P2, action, use_cache=False)
+        np.testing.assert_array_equal(next_board, expected)
+
+
+def test_getNextStates_sets_up_board_once():
+    curl = game.CurlingGame()
+    board = curl.getInitBoard()
+
+    with mock.patch.object(curl.sim, 'setupBoard', wraps=curl.sim.setupBoard) as spy:
+        next_boards = curl.getNextStates(board, c.P1, range(4))
+        assert spy.call_count == 1
+
+    assert next_boards.shape == (4, 6, 16)
+
+
+def test_getNextStates_numpy_physics():
+    curl = game.CurlingGame(physics=game.PHYSICS_NUMPY)
+    board = curl.getInitBoard()
+    actions = [utils.getAction(1, '5', 0), utils.getAction(-1, 'control', 6)]
+
+    next_boards = curl.getNextStates(board, c.P1, actions)
+
+    for action, next_board in zip(actions, next_boards):
+        expected, _ = curl.getNextState(board, c.P1, action, use_cache=False)
+        np.testing.assert_array_equal(next_board, expected)
+
+
+def test_getNextState_transpositions_share_cache():
+    curl = game.CurlingGame(use_transpositions=True)
+    action = c.ACTION_LIST.index((1, '3', -2))
+    board = curl.getInitBoard()
+    board_utils.set_stone(board, c.P1, 0, 10, utils.TEE_LINE)
+    board_utils.set_stone(board, c.P2, 0, -40, utils.TEE_LINE - 100)
+    next_board, _ = curl.getNextState(board, c.P1, action)
+
+    flipped = board.copy()
+    flipped[c.BOARD_X] *= -1
+    curl.sim.setupBoard = mock.Mock(side_effect=UnitTestException)
+    flipped_next, _ = curl.getNextState(flipped, c.P1, utils.mirrorAction(action))
+
+    np.testing.assert_array_equal(flipped_next[c.BOARD_X], -next_board[c.BOARD_X])
+    np.testing.assert_array_equal(flipped_next[c.BOARD_Y], next_board[c.BOARD_Y])
+
+
+def test_mirrored_shot_is_mirrored():
+    curl = game.CurlingGame()
+    board = curl.getInitBoard()
+    board_utils.set_stone(board, c.P1, 0, 10, utils.TEE_LINE)
+    board_utils.set_stone(board, c.P2, 0, -40, utils.TEE_LINE - 100)
+    flipped = board.copy()
+    flipped[c.BOARD_X] *= -1
+
+    for action in range(0, len(c.ACTION_LIST), 7):
+        next_board, _ = curl.getNextState(board, c.P1, action, use_cache=False)
+        flipped_next, _ = curl.getNextState(flipped, c.P1, utils.mirrorAction(action), use_cache=False)
+        np.testing.assert_allclose(flipped_next[c.BOARD_X], -next_board[c.BOARD_X], atol=1e-6)
+        np.testing.assert_allclose(flipped_next[c.BOARD_Y], next_board[c.BOARD_Y], atol=1e-6)
+
+
+def test_pickle_builds_own_simulation():
+    curl = game.CurlingGame(physics='numpy')
+    board = curl.getInitBoard()
+    action = c.ACTION_LIST.index((1, '3', 5))
+    expected, _ = curl.getNextState(board, c.P1, action)
+
+    copy = pickle.loads(pickle.dumps(curl))
+    assert copy.sim is not curl.sim
+    assert copy.physics == game.PHYSICS_NUMPY
+    np.testing.assert_array_equal(copy.getNextState(board, c.P1, action)[0], expected)
@@ -0,0 +1,111 @@
+import multiprocessing
+import pickle
+from unittest import mock
+
+import numpy as np
+
+import log_handler
+from curling import batch_simulation
+from curling import board as board_utils
+from curling import constants as c
+from curling import game
+from curling import shot_cache
+from curling import utils
+
+log_handler.flush_on_error()
+
+
+class UnitTestException(Exception):
+    """For testing expected exceptions."""
+
+
+def _board_with_stone(x):
+    board = board_utils.getInitBoard()
+    board_utils.set_stone(board, c.P1, 0, x, utils.TEE_LINE)
+    return board
+
+
+def _append(filename, x):
+    cache = shot_cache.ShotCache(game.PHYSICS_PYMUNK, filename)
+    board = _board_with_stone(x)
+    cache.put(board, 1, board)
+    cache.close()
+
+
+def test_roundtrip(tmp_path):
+    cache = shot_cache.ShotCache(game.PHYSICS_PYMUNK, str(tmp_path / 'shots.sqlite3'))
+    board = _board_with_stone(1)
+    next_board = _board_with_stone(2)
+
+    assert cache.get(board, 3) is None
+    cache.put(board, 3, next_board)
+
+    np.testing.assert_array_equal(cache.get(board, 3), next_board)
+    assert cache.get(board, 4) is None
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3, 'entries': 1}
+
+
+def test_physics_change_invalidates(tmp_path):
+    filename = str(tmp_path / 'shots.sqlite3')
+    board = _board_with_stone(1)
+    shot_cache.ShotCache(game.PHYSICS_PYMUNK, filename).put(board, 3, board)
+
+    with mock.patch('curling.constants.physics_hash', return_value='changed'):
+        cache = shot_cache.ShotCache(game.PHYSICS_PYMUNK, filename)
+        assert cache.get(board, 3) is None
+        assert cache.purge() == 1
+        assert len(cache) == 0
+
+
+def test_shared_between_processes(tmp_path):
+    filename = str(tmp_path / 'shots.sqlite3')
+    cache = shot_cache.ShotCache(game.PHYSICS_PYMUNK, filename)
+    cache.put(_board_with_stone(0), 1, _board_with_stone(0))
+
+    with multiprocessing.get_context('spawn').Pool(2) as pool:
+        pool.starmap(_append, [(filename, x) for x in range(1, 9)])
+
+    assert len(cache) == 9
+    assert pickle.loads(pickle.dumps(cache)).get(_board_with_stone(8), 1) is not None
+
+
+def test_game_reads_shots_from_other_runs(tmp_path):
+    filename = str(tmp_path / 'shots.sqlite3')
+    board = board_utils.getInitBoard()
+    action = utils.getAction(1, '3', 5)
+    expected, _ = game.CurlingGame(shot_cache_file=filename).getNextState(board, c.P1, action)
+
+    curl = game.CurlingGame(shot_cache_file=filename)
+    curl.sim.setupBoard = mock.Mock(side_effect=UnitTestException)
+    actual, next_player = curl.getNextState(board, c.P1, action)
+
+    assert next_player == c.P2
+    np.testing.assert_array_equal(actual, expected)
+    assert curl.shot_cache.hits == 1
+
+
+def test_backends_do_not_share_shots(tmp_path):
+    filename = str(tmp_path / 'shots.sqlite3')
+    board = board_utils.getInitBoard()
+    action = utils.getAction(1, '3', 5)
+    numpy_game = game.CurlingGame(physics=game.PHYSICS_NUMPY, shot_cache_file=filename)
+    numpy_game.getNextState(board, c.P1, action)
+
+    pymunk_game = game.CurlingGame(physics=game.PHYSICS_PYMUNK, shot_cache_file=filename)
+    pymunk_game.getNextState(board, c.P1, action)
+
+    assert pymunk_game.shot_cache.hits == 0
+    assert len(pymunk_game.shot_cache) == 1
+
+
+def test_physics_code_and_parameters_change_the_tag():
+    tags = {backend: c.physics_hash(backend) for backend in game.PHYSICS_BACKENDS}
+    assert tags[game.PHYSICS_NUMPY] != tags[game.PHYSICS_PYMUNK]
+
+    with mock.patch.object(utils, 'STONE_FRICTION', utils.STONE_FRICTION * 2):
+        assert all(c.physics_hash(backend) != tag for backend, tag in tags.items())
+    with mock.patch.object(utils, 'getCurlingForce', lambda *args: 0):
+        assert all(c.physics_hash(backend) != tag for backend, tag in tags.items())
+    with mock.patch.object(batch_simulation, 'ANGULAR_DAMPING', 0):
+        assert c.physics_hash(game.PHYSICS_NUMPY) != tags[game.PHYSICS_NUMPY]
+        assert c.physics_hash(game.PHYSICS_PYMUNK) == tags[game.PHYSICS_PYMUNK]
@@ -2,6 +2,7 @@
 To run tests:
 pytest test_game.py
 """
+from unittest import mock
 
 import numpy as np
 
@@ -168,3 +169,34 @@ def test_simulation_getBoard_has_extra_data():
     board_utils.update_distance_and_score(expected)
 
     np.testing.assert_array_equal(actual, expected)
+
+
+def test_setupBoard_reuses_stones():
+    sim = simulation.Simulation()
+    board = sim.getBoard()
+    board_utils.configure_hammer_2_scenario(board)
+
+    sim.setupBoard(board)
+    stones = set(sim.getStones())
+    with mock.patch.object(utils, 'newStone', side_effect=AssertionError('Stone created')):
+        sim.setupBoard(board_utils.getInitBoard())
+        sim.setupBoard(board)
+
+    assert set(sim.getStones()) == stones
+
+
+def test_pooled_stones_match_fresh_simulation():
+    board = board_utils.getInitBoard()
+    board_utils.configure_hammer_2_scenario(board)
+    board_utils.set_stone(board, c.P2, 7, 0, 0, c.NOT_THROWN, c.IN_PLAY)
+    actions = [utils.getAction(-1, 'control', 6), utils.getAction(-1, '3', 5), utils.getAction(1, '7', 0)] * 2
+    pooled = simulation.Simulation()
+
+    for action in actions:
+        fresh = simulation.Simulation()
+        for sim in (fresh, pooled):
+            sim.setupBoard(board)
+            sim.setupAction(c.P2, action)
+            sim.run()
+
+        np.testing.assert_array_equal(pooled.getBoard(), fresh.getBoard())
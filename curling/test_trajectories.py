@@ -0,0 +1,115 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+
+import log_handler
+from curling import batch_simulation
+from curling import board as board_utils
+from curling import constants as c
+from curling import game
+from curling import simulation
+from curling import trajectories
+from curling import utils
+
+log_handler.flush_on_error()
+
+
+class UnitTestException(Exception):
+    """For testing expected exceptions."""
+
+
+@pytest.fixture(scope='module')
+def table():
+    return trajectories.TrajectoryTable.build()
+
+
+def test_table_matches_simulation(table):
+    curl = game.CurlingGame()
+    board = curl.getInitBoard()
+
+    for action in range(0, len(c.ACTION_LIST), 13):
+        assert table.isClear(board, action)
+        expected, _ = curl.getNextState(board, c.P1, action, use_cache=False)
+        np.testing.assert_allclose(table.getNextBoard(board, c.P1, action), expected, atol=1e-6)
+
+
+def test_blocked_path(table):
+    board = board_utils.getInitBoard()
+    action = utils.getAction(1, '5', 0)
+    x, y = table.rest[action]
+    board_utils.set_stone(board, c.P1, 0, x + utils.STONE_RADIUS, y - utils.STONE_RADIUS)
+
+    assert not table.isClear(board, action)
+    assert table.isClear(board, utils.getAction(-1, '3', 5))  # guard stops well short
+
+
+def test_out_of_play_stones_dont_block(table):
+    board = board_utils.getInitBoard()
+    action = utils.getAction(1, '5', 0)
+    x, y = table.rest[action]
+    board_utils.set_stone(board, c.P1, 0, x, y, in_play=c.OUT_OF_PLAY)
+
+    assert table.isClear(board, action)
+
+
+def test_getNextState_skips_physics(table):
+    curl = game.CurlingGame()
+    board = curl.getInitBoard()
+    board_utils.configure_hammer_2_scenario(board)
+    board_utils.set_stone(board, c.P2, 7, 0, 0, c.NOT_THROWN, c.IN_PLAY)
+    action = utils.getAction(-1, '3', 5)
+    expected, _ = curl.getNextState(board, c.P2, action, use_cache=False)
+
+    curl.trajectories = table
+    curl.sim.setupBoard = mock.Mock(side_effect=UnitTestException)
+    actual, next_player = curl.getNextState(board, c.P2, action, use_cache=False)
+
+    assert next_player == c.P1
+    np.testing.assert_allclose(actual, expected, atol=1e-6)
+
+
+def test_stale_table_is_rebuilt(table, tmp_path):
+    filename = str(tmp_path / 'trajectories.npz')
+    table.save(filename)
+
+    with mock.patch.object(trajectories.TrajectoryTable, 'build', side_effect=UnitTestException):
+        trajectories.TrajectoryTable.load(filename)
+
+        with mock.patch('curling.constants.physics_hash', return_value='changed'):
+            with pytest.raises(UnitTestException):
+                trajectories.TrajectoryTable.load(filename)
+        # The table comes from the numpy backend, so its physics code makes it stale too.
+        with mock.patch.object(batch_simulation, 'ANGULAR_DAMPING', 0):
+            with pytest.raises(UnitTestException):
+                trajectories.TrajectoryTable.load(filename)
+
+
+def test_run_fast_forwards_to_contact(table):
+    board = board_utils.getInitBoard()
+    board_utils.configure_hammer_2_scenario(board)
+    board_utils.set_stone(board, c.P2, 7, 0, 0, c.NOT_THROWN, c.IN_PLAY)
+    stepped = simulation.Simulation()
+    fast = simulation.Simulation(trajectories=table)
+
+    for action in [utils.getAction(1, '5', 0), utils.getAction(-1, 'control', 2), utils.getAction(1, '8', -3)]:
+        for sim in (stepped, fast):
+            sim.setupBoard(board)
+            sim.setupAction(c.P2, action)
+            sim.run()
+
+        assert stepped.steps_skipped == 0
+        assert fast.steps_skipped > 0
+        assert fast.steps_run < stepped.steps_run
+        np.testing.assert_allclose(fast.getBoard(), stepped.getBoard(), atol=1e-6)
+
+
+def test_getFreeSteps_stops_before_contact(table):
+    action = utils.getAction(1, '5', 0)
+    stone = table.rest[action]
+
+    steps = table.getFreeSteps(action, stone[None])
+
+    assert 0 < steps < table.steps[action]
+    distance = np.linalg.norm(table.paths[action][steps] - stone)
+    assert distance > 2 * utils.STONE_RADIUS
@@ -0,0 +1,151 @@
+"""
+Precomputed empty-ice shots.
+
+Every shot starts at (0, 0) with one of the `c.ACTION_LIST` velocities, so as long as nothing lies in the shooter's
+path the outcome only depends on the action. `TrajectoryTable` stores the swept path and the resting position of every
+action on empty ice and `getNextBoard` places the shooter straight from the table when the path is clear. When the
+path is blocked `getFreeSteps` tells `simulation.Simulation.run` how far it can jump ahead before the first contact.
+"""
+import logging
+import os
+
+import numpy as np
+
+from curling import batch_simulation
+from curling import board as board_utils
+from curling import constants as c
+from curling import simulation
+from curling import utils
+
+log = logging.getLogger(__name__)
+
+PHYSICS = 'numpy'  # the table is built with batch_simulation, so it goes stale with that backend's physics
+
+
+class TrajectoryTable:
+
+    def __init__(self, paths: np.array, velocities: np.array, spins: np.array, steps: np.array, in_play: np.array):
+        """
+        paths: (actions, steps + 1, 2) shooter positions before the first and after every step, padded with the
+            final position.
+        velocities: same as paths, but velocities.
+        spins: (actions, steps + 1) angular velocities.
+        steps: (actions,) number of steps until the shooter stops.
+        in_play: (actions,) whether the shooter is still in play once it stops.
+        """
+        self.paths = paths
+        self.velocities = velocities
+        self.spins = spins
+        self.steps = steps
+        self.in_play = in_play
+        self.rest = paths[np.arange(len(paths)), steps]
+
+        # Stones touch when centers are within 2 radii; pad by the longest single step between samples.
+        step = np.linalg.norm(np.diff(paths, axis=1), axis=-1).max()
+        self.clearance = 2 * utils.STONE_RADIUS + step
+        self.lower = paths.min(axis=1) - self.clearance
+        self.upper = paths.max(axis=1) + self.clearance
+
+        reach = utils.STONE_RADIUS + batch_simulation.WALL_RADIUS + step
+        x, y = paths[..., 0], paths[..., 1]
+        touching = (
+            (x - batch_simulation.WALL_LEFT < reach) |
+            (batch_simulation.WALL_RIGHT - x < reach) |
+            (batch_simulation.WALL_BACK - y < reach)
+        )
+        self.wall_steps = np.where(touching.any(axis=1), touching.argmax(axis=1), steps)
+
+    @classmethod
+    def build(cls, deltaTime=c.DT):
+        """Throw every action on empty ice, recording the shooter after each step."""
+        log.info('Building trajectory table for %s actions', len(c.ACTION_LIST))
+        actions = np.arange(len(c.ACTION_LIST))
+        sim = batch_simulation.BatchSimulation()
+        sim.setupBoards(np.repeat(board_utils.getInitBoard()[None], len(actions), axis=0))
+        sim.setupActions(c.P1, actions)
+
+        shooter = sim.shooter[0]
+        paths = [sim.position[:, shooter].copy()]
+        velocities = [sim.velocity[:, shooter].copy()]
+        spins = [sim.spin[:, shooter].copy()]
+        steps = np.zeros(len(actions), int)
+        running = sim.moving()
+        while running.any():
+            idx = np.flatnonzero(running)
+            sim.step(idx, deltaTime)
+            paths.append(sim.position[:, shooter].copy())
+            velocities.append(sim.velocity[:, shooter].copy())
+            spins.append(sim.spin[:, shooter].copy())
+            steps[idx] += 1
+            running[idx] = sim.moving()[idx]
+            if len(paths) * deltaTime > 60:
+                raise simulation.Timeout()
+
+        return cls(
+            np.stack(paths, axis=1), np.stack(velocities, axis=1), np.stack(spins, axis=1), steps,
+            sim.active[:, shooter].copy())
+
+    @classmethod
+    def load(cls, filename=c.TRAJECTORY_FILE):
+        """Load the table from disk, (re)building it if it's missing or was built with different physics."""
+        if os.path.isfile(filename):
+            with np.load(filename) as data:
+                if str(data['physics']) == c.physics_hash(PHYSICS):
+                    return cls(data['paths'], data['velocities'], data['spins'], data['steps'], data['in_play'])
+            log.warning('Trajectory table %s is stale. Rebuilding.', filename)
+
+        table = cls.build()
+        table.save(filename)
+        return table
+
+    def save(self, filename=c.TRAJECTORY_FILE):
+        np.savez_compressed(
+            filename, paths=self.paths, velocities=self.velocities, spins=self.spins, steps=self.steps,
+            in_play=self.in_play, physics=c.physics_hash(PHYSICS))
+
+    def isClear(self, board: np.array, action: int) -> bool:
+        """True if no stone in play comes within two radii of the action's empty-ice path."""
+        on_ice = (board[c.BOARD_THROWN] == c.THROWN) & (board[c.BOARD_IN_PLAY] == c.IN_PLAY)
+        stones = board[[c.BOARD_X, c.BOARD_Y]][:, on_ice].T
+        return self._firstContact(action, stones) > self.steps[action]
+
+    def getFreeSteps(self, action: int, stones: np.array) -> int:
+        """
+        Number of steps the shooter can take from (0, 0) before it may touch one of the resting `stones` (k, 2) or a
+        wall. Stepping from there on has to be done by the simulation.
+        """
+        last = min(self._firstContact(action, stones), self.wall_steps[action], self.steps[action])
+        return max(int(last) - 1, 0)
+
+    def _firstContact(self, action, stones):
+        """Index of the first point on the path within clearance of any of `stones`, or the path length."""
+        if len(stones) == 0:
+            return len(self.paths[action])
+
+        near = ((stones > self.lower[action]) & (stones < self.upper[action])).all(axis=-1)
+        if not near.any():
+            return len(self.paths[action])
+
+        delta = self.paths[action][None, :, :] - stones[near][:, None, :]
+        touching = (np.einsum('spk,spk->sp', delta, delta) < self.clearance ** 2).any(axis=0)
+        return int(touching.argmax()) if touching.any() else len(self.paths[action])
+
+    def getNextBoard(self, board: np.array, player: int, action: int) -> np.array:
+        """Same board as the simulation would return for a shot with a clear path."""
+        next_board = board.copy()
+        on_ice = (board[c.BOARD_THROWN] == c.THROWN) & (board[c.BOARD_IN_PLAY] == c.IN_PLAY)
+        next_board[c.BOARD_X][~on_ice] = 0
+        next_board[c.BOARD_Y][~on_ice] = 0
+
+        stone_id = simulation.getNextStoneId(board)
+        if player == c.P2:
+            stone_id += 8
+        next_board[c.BOARD_THROWN][stone_id] = c.THROWN
+        if self.in_play[action]:
+            next_board[c.BOARD_X][stone_id], next_board[c.BOARD_Y][stone_id] = self.rest[action]
+            next_board[c.BOARD_IN_PLAY][stone_id] = c.IN_PLAY
+        else:
+            next_board[c.BOARD_IN_PLAY][stone_id] = c.OUT_OF_PLAY
+
+        board_utils.update_distance_and_score(next_board)
+        return next_board
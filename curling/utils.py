@@ -35,6 +35,9 @@ TEE_LINE = HOG_LINE + dist(feet=21)
 
 BOX_LENGTH_WITH_BUFFER = BOX_LENGTH + BACKLINE_BUFFER
 
+STONE_FRICTION = 1.004  # interaction with other objects, not with "ice"
+STONE_ELASTICITY = 0.999999
+
 # For conversion between Board and Real
 X_SCALE = (ICE_WIDTH - 2.0 * STONE_RADIUS + 1) / ICE_WIDTH  # Don't know why +1 but makes the tests pass.
 Y_SCALE = (BOX_LENGTH_WITH_BUFFER - (2.0 * STONE_RADIUS) + 1) / BOX_LENGTH_WITH_BUFFER
@@ -62,6 +65,7 @@ class Space(pymunk.Space):
         self.removed_stones = []
         self.thrown_stones = []
         self.inplay_stones = []
+        self.touched_stones = set()  # stones that touched anything since the board was last set up
 
         self.shooter_color = 'Unknown'
 
@@ -167,6 +171,14 @@ def decodeAction(action: int) -> Tuple[int, str, int]:
     return c.ACTION_LIST[action]
 
 
+def mirrorAction(action: int) -> int:
+    """Same shot mirrored over the center line: opposite handle and broom."""
+    return _MIRRORED_ACTIONS[action]
+
+
+_MIRRORED_ACTIONS = tuple(getAction(-h, w, -b) for h, w, b in c.ACTION_LIST)
+
+
 def weight_to_dist(w):
     return dist(feet=c.WEIGHT_FT[w.lower()])
 
@@ -241,6 +253,7 @@ def addBoundaries(space: Space):
 
     def remove_stone(arbiter, local_space, data):
         stone, wall = arbiter.shapes
+        local_space.touched_stones.add(stone)
 
         if getattr(stone, 'already_removed', False):
             return False
@@ -259,6 +272,16 @@ def addBoundaries(space: Space):
     space.add(w1, w2, w3)
 
 
+def trackStoneContacts(space: Space):
+    """Record every stone that touches another stone in `space.touched_stones`."""
+
+    def touched(arbiter, local_space, data):
+        local_space.touched_stones.update(arbiter.shapes)
+        return True
+
+    space.add_collision_handler(1, 1).begin = touched
+
+
 def still_moving(shape):
     vx = abs(shape.body.velocity.x) > 0.001
     vy = abs(shape.body.velocity.y) > 0.001
@@ -271,9 +294,9 @@ def newStone(color: str):
     stone = Stone(body, STONE_RADIUS)
     stone.mass = c.STONE_MASS
     stone.color = color
-    stone.friction = 1.004  # interaction with other objects, not with "ice"
+    stone.friction = STONE_FRICTION
     stone.density = 1
-    stone.elasticity = 0.999999
+    stone.elasticity = STONE_ELASTICITY
 
     stone.collision_type = 1
     return stone
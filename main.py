@@ -18,19 +18,38 @@ log.addHandler(stream)
 fmt = '%(asctime)s %(filename).5s:%(lineno)s %(funcName)s [%(levelname)s] %(message)s'
 coloredlogs.install(level='INFO', fmt=fmt)
 
-torch.set_num_interop_threads(4)
-torch.set_num_threads(4)
+# Self-play workers re-import this module (as __mp_main__). One thread each keeps them off each other's cores.
+torch.set_num_interop_threads(4 if __name__ == '__main__' else 1)
+torch.set_num_threads(4 if __name__ == '__main__' else 1)
 
 args = dotdict({
     'numIters': 200,
     'numEps': 10,  # Number of complete self-play games to simulate during a new iteration.
+    'numSelfPlayWorkers': 4,  # Processes playing self-play games in parallel. 1 plays them in this process.
+    'seed': None,  # Seed for self-play random streams. None draws one from the OS.
+    'asyncTraining': False,  # Run self-play, training and arena at the same time (Coach.learnAsync).
+    'inferenceServer': True,  # Self-play workers share one network process that batches their predictions.
+    'inferenceMaxBatch': 64,  # Most boards the inference server runs in one batch.
+    'inferenceMaxWait': 0.002,  # Seconds the inference server waits for more requests before running a batch.
+    'inferenceThreads': 4,  # Torch threads of the inference server. Other spawned processes get one each.
     'tempThreshold': 4,  # Number of moves to "explore" before choosing optimal moves
     'updateThreshold': 0.51,
     # During arena playoff, new neural net will be accepted if threshold or more of games are won.
     'maxlenOfQueue': 500,  # Number of game examples to train the neural networks.
     'numMCTSSims': 90,  # Number of games moves for MCTS to simulate.
+    # Raise only once an arena against mctsBatchSize 1 shows virtual loss costs no strength.
+    'mctsBatchSize': 1,  # Leaves MCTS collects (with virtual loss) before evaluating them in one batch. 1 disables.
     'arenaCompare': 8,  # Number of games to play during arena play to determine if new net will be accepted.
+    'numArenaWorkers': 4,  # Processes playing arena games in parallel. 1 plays them in this process.
+    'arenaOpeningMoves': 1,  # Random shots opening each pair of parallel arena games, so games don't replay each other.
+    'arenaEarlyStop': True,  # Stop the arena once a sequential test (SPRT) decides. arenaCompare is then the cap.
     'cpuct': 1,
+    # Stone physics backend: 'pymunk' or 'numpy'. numpy is vectorized over many shots (curling/batch_simulation.py),
+    # but self-play simulates one shot at a time, where it's about 2x slower (python -m curling.benchmark_physics).
+    'physics': 'pymunk',
+    'trajectories': True,  # Place shots with a clear path from a precomputed table instead of simulating them.
+    'shot_cache': './curling/shot_cache.sqlite3',  # Shot outcomes shared between runs and processes. None disables.
+    'transpositions': True,  # Merge boards that only differ by stone order or a mirror image (MCTS and caches).
 
     'checkpoint': './curling/data_10_layers_256/',
     'load_folder_file': ('./curling/data_10_layers_256/', 'checkpoint_best.pth.tar'),
@@ -44,7 +63,8 @@ args['load_model'] = path.exists(''.join(args['load_folder_file']))
 def main():
     log.info('Cuda enabled: %s', torch.cuda.is_available())
     log.info('Loading Curling...')
-    g = CurlingGame()
+    g = CurlingGame(physics=args.physics, use_trajectories=args.trajectories, shot_cache_file=args.shot_cache,
+                    use_transpositions=args.transpositions)
 
     log.info('Loading nn...')
     nnet = nn(g)
@@ -63,7 +83,10 @@ def main():
         c.loadTrainExamples()
 
     log.info('Learning...')
-    c.learn()
+    if args.asyncTraining:
+        c.learnAsync()
+    else:
+        c.learn()
 
 
 if __name__ == "__main__":
@@ -1,12 +1,15 @@
+import copy
 import os
 
 import numpy as np
 import torch
 import torch.optim as optim
+from torch import nn
 from tqdm import tqdm
 
 from NeuralNet import NeuralNet
-from pytorch.ann_models import Model
+from ReplayBuffer import ReplayBuffer
+from pytorch import ann_models, cnn_models, set_models
 from utils import dotdict, AverageMeter
 
 tqdm.monitor_interval = 0
@@ -19,23 +22,39 @@ args = dotdict({
     'cuda': torch.cuda.is_available(),
     'num_channels': 64,
     'layers': 5,
+    'model': 'ann',  # One of MODELS.
+    'quantize': False,  # Predict with an int8 copy of the Linear layers (CPU only). Training stays in float.
 })
 
+MODELS = {
+    'ann': ann_models.Model,  # Linear layers over the rows of the board
+    'cnn': cnn_models.Model,  # Convolutions over the board as an image
+    'set': set_models.Model,  # Shared network per stone, pooled per team (DeepSets)
+}
+
 
 class NNetWrapper(NeuralNet):
     def __init__(self, game):
         super().__init__(game)
-        self.nnet = Model(game, args)
+        self.game = game
+        self.nnet = MODELS[args.model](game, args)
         self.board_x, self.board_y = game.getBoardSize()
         self.action_size = game.getActionSize()
+        self.inputs = None  # predict_batch's input buffer, grown to the largest batch seen
+        self.quantized = None  # int8 copy of nnet that predictions use, see quantize()
 
         if args.cuda:
             self.nnet.cuda()
+        self.nnet.eval()
+        if args.quantize:
+            self.quantize()
 
     def train(self, examples):
         """
-        examples: list of examples, each example is of form (board, pi, v)
+        examples: ReplayBuffer, or list of examples, each example is of form (board, pi, v)
         """
+        if not isinstance(examples, ReplayBuffer):
+            examples = ReplayBuffer.fromExamples(examples)
         optimizer = optim.Adam(self.nnet.parameters())
         batches = int(len(examples) / args.batch_size)
 
@@ -46,11 +65,9 @@ class NNetWrapper(NeuralNet):
 
             tqdm1 = tqdm(range(batches), desc="Training", ncols=100, leave=False)
             for _ in tqdm1:
-                sample_ids = np.random.randint(len(examples), size=args.batch_size)
-                boards, pis, vs = list(zip(*[examples[i] for i in sample_ids]))
-                boards = torch.FloatTensor(np.array(boards).astype(np.float64))
-                target_pis = torch.FloatTensor(np.array(pis))
-                target_vs = torch.FloatTensor(np.array(vs).astype(np.float64))
+                boards, pis, vs = examples.sample(args.batch_size)
+                boards, pis = self.game.getRandomSymmetries(boards, pis)
+                boards, target_pis, target_vs = map(torch.from_numpy, (boards, pis, vs))
 
                 # predict
                 if args.cuda:
@@ -70,23 +87,33 @@ class NNetWrapper(NeuralNet):
                 optimizer.zero_grad()
                 total_loss.backward()
                 optimizer.step()
+        self.nnet.eval()
+        if self.quantized is not None:
+            self.quantize()
         print()  # Correct line for nested tqdm
 
     def predict(self, board):
         """
         board: np array with board
         """
+        pis, vs = self.predict_batch(board[np.newaxis])
+        return pis[0], vs[0]
 
-        # preparing input
-        board = torch.FloatTensor(board.astype(np.float64))
-        if args.cuda: board = board.contiguous().cuda()
-        board = board.view(1, self.board_x, self.board_y)
-        self.nnet.eval()
-        with torch.no_grad():
-            pi, v = self.nnet(board)
+    def predict_batch(self, boards):
+        """
+        boards: np array of boards stacked along the first axis, (B, board_x, board_y)
 
-        # print('PREDICTION TIME TAKEN : {0:03f}'.format(time.time()-start))
-        return torch.exp(pi).data.cpu().numpy()[0], v.data.cpu().numpy()[0]
+        Returns (B, action_size) policies and (B,) values.
+        """
+        if self.inputs is None or len(self.inputs) < len(boards):
+            self.inputs = torch.empty((len(boards), self.board_x, self.board_y),
+                                      device='cuda' if args.cuda else 'cpu')
+        inputs = self.inputs[:len(boards)]
+        inputs.copy_(torch.from_numpy(np.asarray(boards)))  # converts to float32 on the way
+        model = self.nnet if self.quantized is None else self.quantized
+        with torch.no_grad():
+            pi, v = model(inputs)
+            return torch.exp(pi).cpu().numpy(), v.view(-1).cpu().numpy()
 
     def loss_pi(self, targets, outputs):
         return -torch.sum(targets * outputs) / targets.size()[0]
@@ -111,3 +138,18 @@ class NNetWrapper(NeuralNet):
         map_location = None if args.cuda else 'cpu'
         checkpoint = torch.load(filepath, map_location=map_location)
         self.nnet.load_state_dict(checkpoint['state_dict'])
+        if self.quantized is not None:
+            self.quantize()
+
+    def quantize(self):
+        """
+        Makes predictions use a copy of the network with its Linear layers
+        quantized to int8 (PyTorch dynamic quantization, CPU only). Weights
+        are quantized once here and activations on every call. The float
+        network is still the one trained and saved. Quantized again from it
+        after train() and load_checkpoint().
+        """
+        if args.cuda:
+            raise ValueError('Dynamic quantization runs on CPU only.')
+        self.quantized = torch.quantization.quantize_dynamic(
+            copy.deepcopy(self.nnet).eval(), {nn.Linear}, dtype=torch.qint8)
@@ -0,0 +1,86 @@
+"""
+Compares the models NNetWrapper can use: size, multiply-adds and latency per
+evaluation, for one board and for batches.
+
+    python -m pytorch.benchmark_models --batch 64
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from torch import nn
+
+from curling import board as board_utils
+from curling.game import CurlingGame
+from pytorch.NNet import MODELS
+from utils import dotdict
+
+CONFIGS = {
+    'ann': dotdict({'layers': 5, 'num_channels': 64, 'dropout': 0.3}),
+    # cnn_models loses 2 rows per layer past the second: 4 layers is the deepest that fits a 6 x 16 board.
+    'cnn': dotdict({'layers': 4, 'num_channels': 256, 'dropout': 0.3}),
+    'set': dotdict({'layers': 5, 'num_channels': 64, 'dropout': 0.3}),
+}
+
+
+def multiplyAdds(model, boards):
+    """Multiply-adds of the Linear and Conv2d layers for one board."""
+    total = 0
+
+    def count(module, inputs, output):
+        nonlocal total
+        if isinstance(module, nn.Linear):
+            total += output.numel() * module.in_features
+        else:
+            total += output.numel() * module.in_channels * module.kernel_size[0] * module.kernel_size[1]
+
+    hooks = [module.register_forward_hook(count) for module in model.modules()
+             if isinstance(module, (nn.Linear, nn.Conv2d))]
+    with torch.no_grad():
+        model(boards)
+    for hook in hooks:
+        hook.remove()
+    return total // len(boards)
+
+
+def latency(model, boards, repeats):
+    """Seconds per call of model on boards, best of 3 rounds of repeats."""
+    rounds = []
+    with torch.no_grad():
+        model(boards)  # warm up
+        for _ in range(3):
+            start = time.perf_counter()
+            for _ in range(repeats):
+                model(boards)
+            rounds.append((time.perf_counter() - start) / repeats)
+    return min(rounds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, default=64, help='Boards per batch')
+    parser.add_argument('--repeats', type=int, default=200, help='Calls per timing round')
+    parser.add_argument('--threads', type=int, default=1, help='Torch threads')
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    game = CurlingGame(physics='numpy')
+    board = game.getInitBoard()
+    board_utils.configure_hammer_2_scenario(board)
+    one = torch.from_numpy(board[np.newaxis].astype(np.float32))
+    batch = one.repeat(args.batch, 1, 1)
+
+    print(f'{"model":6} {"params":>10} {"MB":>7} {"MACs":>11} {"1 board us":>11} {"batch us/board":>15}')
+    for name, config in CONFIGS.items():
+        model = MODELS[name](game, config).eval()
+        params = sum(p.numel() for p in model.parameters())
+        size = sum(t.numel() * t.element_size() for t in model.state_dict().values()) / 2 ** 20
+        single = latency(model, one, args.repeats)
+        batched = latency(model, batch, max(args.repeats // 10, 1)) / args.batch
+        print(f'{name:6} {params:10,} {size:7.2f} {multiplyAdds(model, one):11,} {single * 1e6:11.0f} '
+              f'{batched * 1e6:15.1f}')
+
+
+if __name__ == '__main__':
+    main()
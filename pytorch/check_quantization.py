@@ -0,0 +1,76 @@
+"""
+Compares NNetWrapper's int8 quantized predictions (args.quantize) with the
+float network of the same checkpoint, on boards from stored training
+examples: how often the policy argmax agrees, the value error, latency and
+model size.
+
+    python -m pytorch.check_quantization ./curling/data/ checkpoint_best.pth.tar
+"""
+import argparse
+import io
+import json
+import os
+
+import numpy as np
+import torch
+
+from curling.game import CurlingGame
+from pytorch.NNet import NNetWrapper
+from pytorch.benchmark_models import latency
+
+
+def loadBoards(examples_file, count, seed=0):
+    """count boards drawn from the example chunks listed in the manifest examples_file (see Coach.saveTrainExamples)."""
+    with open(examples_file) as f:
+        chunks = json.load(f)['chunks']
+    folder = os.path.dirname(examples_file)
+    boards = np.concatenate([np.load(os.path.join(folder, f"{chunk['chunk']}.boards.npy"), mmap_mode='r')
+                             for chunk in chunks])
+    indices = np.random.default_rng(seed).choice(len(boards), size=min(count, len(boards)), replace=False)
+    return boards[np.sort(indices)]
+
+
+def modelSize(model):
+    """Bytes of the model's saved state dict."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('folder', help='Checkpoint folder')
+    parser.add_argument('filename', help='Checkpoint file, with its examples manifest at <filename>.examples')
+    parser.add_argument('--boards', type=int, default=2000, help='Boards to compare on')
+    parser.add_argument('--batch', type=int, default=64, help='Boards per batch when timing')
+    parser.add_argument('--threads', type=int, default=1, help='Torch threads')
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    game = CurlingGame(physics='numpy')
+    nnet = NNetWrapper(game)
+    nnet.load_checkpoint(args.folder, args.filename)
+    boards = loadBoards(os.path.join(args.folder, args.filename + '.examples'), args.boards)
+
+    pis, vs = nnet.predict_batch(boards)
+    nnet.quantize()
+    q_pis, q_vs = nnet.predict_batch(boards)
+    errors = np.abs(q_vs - vs)
+    print(f'{len(boards)} boards')
+    agrees = pis.argmax(axis=1) == q_pis.argmax(axis=1)
+    top2 = np.sort(pis, axis=1)[:, -2:]
+    clear = top2[:, 1] - top2[:, 0] > 1e-3  # the float network's best action isn't a near tie
+    print(f'policy argmax agrees: {agrees.mean():.1%}, {agrees[clear].mean():.1%} of {clear.sum()} without a near tie')
+    print(f'policy max abs error: {np.abs(q_pis - pis).max():.4f}')
+    print(f'value abs error: mean {errors.mean():.4f}, max {errors.max():.4f}')
+
+    one = torch.from_numpy(boards[:1].astype(np.float32))
+    batch = torch.from_numpy(np.resize(boards, (args.batch,) + boards.shape[1:]).astype(np.float32))
+    print(f'{"":10} {"1 board us":>11} {"batch us/board":>15} {"MB":>7}')
+    for name, model in (('float', nnet.nnet), ('int8', nnet.quantized)):
+        print(f'{name:10} {latency(model, one, 200) * 1e6:11.0f} '
+              f'{latency(model, batch, 20) / args.batch * 1e6:15.1f} {modelSize(model) / 2 ** 20:7.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Exports a checkpoint for serving, with the model NNetWrapper is set up for
+(pytorch/NNet.args):
+
+    <out>.pt   the traced and frozen TorchScript model, with the metadata
+               as the extra file metadata.json
+    <out>.npz  the same graph as NumPy ops, weights and metadata, for
+               pytorch/runtime.py (see best_action_lean.py)
+
+    python -m pytorch.export ./curling/data/ checkpoint_best.pth.tar ./curling/data/best
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import torch
+
+from curling import constants as c
+from curling.game import CurlingGame
+from pytorch import NNet
+from pytorch.runtime import OPS
+
+
+def freeze(nnet):
+    """
+    The wrapper's network traced on one board and frozen: weights become
+    constants of the graph. torch.jit.freeze came with torch 1.7; before
+    that the traced model is returned as it is, and lower reads its weights.
+    """
+    model = nnet.nnet.cpu().eval()
+    example = torch.zeros((1, nnet.board_x, nnet.board_y))
+    traced = torch.jit.trace(model, example)
+    if getattr(torch.jit, 'freeze', None) is None:
+        return traced
+    return torch.jit.freeze(traced)
+
+
+def lower(frozen):
+    """
+    The graph of a frozen (or on torch 1.6, traced) model as a program for
+    pytorch/runtime.py.
+    Returns the program and its tensor constants, by name.
+    """
+    graph = frozen.inlined_graph
+    module, board = graph.inputs()  # the first input is the module itself
+    modules = {module.debugName(): frozen}  # submodules of a model that isn't frozen
+    constants, arrays, nodes = {}, {}, []
+    for node in graph.nodes():
+        kind = node.kind()
+        if kind == 'prim::GetAttr':
+            value = getattr(modules[node.input().debugName()], node.s('name'))
+            if isinstance(value, torch.Tensor):
+                arrays[node.output().debugName()] = value.detach().numpy()
+            else:
+                modules[node.output().debugName()] = value
+            continue
+        if kind == 'prim::Constant':
+            value = node.output().toIValue()
+            if isinstance(value, torch.Tensor):
+                arrays[node.output().debugName()] = value.detach().numpy()
+            else:
+                constants[node.output().debugName()] = value
+            continue
+        if kind not in OPS:
+            raise ValueError(f'{kind} has no NumPy version in pytorch/runtime.py')
+        nodes.append({
+            'op': kind,
+            'inputs': [value.debugName() for value in node.inputs()],
+            'outputs': [value.debugName() for value in node.outputs()],
+        })
+    program = {
+        'input': board.debugName(),
+        'output': next(graph.outputs()).debugName(),
+        'nodes': nodes,
+        'constants': constants,
+        'arrays': sorted(arrays),
+    }
+    return program, arrays
+
+
+def export(game, folder, filename, out):
+    """Writes out.pt and out.npz for checkpoint folder/filename. Returns the metadata."""
+    nnet = NNet.NNetWrapper(game)
+    nnet.load_checkpoint(folder, filename)
+    metadata = {
+        'checkpoint': os.path.join(folder, filename),
+        'model': NNet.args.model,
+        'board_size': list(game.getBoardSize()),
+        'action_list': [list(action) for action in c.ACTION_LIST],
+    }
+    frozen = freeze(nnet)
+    torch.jit.save(frozen, out + '.pt', _extra_files={'metadata.json': json.dumps(metadata)})
+
+    program, arrays = lower(frozen)
+    np.savez(out + '.npz', metadata=json.dumps(metadata), program=json.dumps(program),
+             **{f'constants/{name}': array for name, array in arrays.items()})
+    return metadata
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('folder', help='Checkpoint folder')
+    parser.add_argument('filename', help='Checkpoint file')
+    parser.add_argument('out', help='Path of the exported files, without extension')
+    args = parser.parse_args()
+    export(CurlingGame(physics='numpy'), args.folder, args.filename, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Runs models exported by pytorch/export.py with NumPy alone. Importing this
+module doesn't import torch, which takes most of a process' start up.
+"""
+import json
+
+import numpy as np
+
+
+def _linear(x, weight, bias):
+    x = x @ weight.T
+    return x if bias is None else x + bias
+
+
+def _flatten(x, start, end):
+    end = end % x.ndim
+    return x.reshape(x.shape[:start] + (-1,) + x.shape[end + 1:])
+
+
+def _log_softmax(x, dim, dtype=None):
+    x = x - x.max(axis=dim, keepdims=True)
+    return x - np.log(np.exp(x).sum(axis=dim, keepdims=True))
+
+
+def _batch_norm(x, weight, bias, running_mean, running_var, training, momentum, eps, *_):
+    shape = (1, -1) + (1,) * (x.ndim - 2)  # statistics are per channel, the second axis
+    x = (x - running_mean.reshape(shape)) / np.sqrt(running_var.reshape(shape) + eps)
+    if weight is not None:
+        x = x * weight.reshape(shape)
+    return x if bias is None else x + bias.reshape(shape)
+
+
+def _convolution(x, weight, bias, stride, padding, dilation, transposed, output_padding, groups, *_):
+    if transposed or groups != 1 or any(d != 1 for d in dilation):
+        raise ValueError('Only plain convolutions are supported.')
+    x = np.pad(x, [(0, 0), (0, 0)] + [(p, p) for p in padding])
+    windows = np.lib.stride_tricks.sliding_window_view(x, weight.shape[2:], axis=(2, 3))
+    windows = windows[:, :, ::stride[0], ::stride[1]]
+    x = np.einsum('bchwij,ocij->bohw', windows, weight)
+    return x if bias is None else x + bias[:, None, None]
+
+
+# TorchScript ops (as in a frozen, traced graph) and what they do on NumPy arrays.
+# Ops with several outputs return a tuple.
+OPS = {
+    'aten::view': lambda x, shape: x.reshape(shape),
+    'aten::reshape': lambda x, shape: x.reshape(shape),
+    'aten::flatten': _flatten,
+    'aten::transpose': lambda x, a, b: np.swapaxes(x, a, b),
+    'aten::size': lambda x, dim: x.shape[dim],
+    'aten::linear': _linear,
+    'aten::_convolution': _convolution,
+    'aten::batch_norm': _batch_norm,
+    'aten::relu': lambda x: np.maximum(x, 0),
+    'aten::tanh': np.tanh,
+    'aten::sign': np.sign,
+    'aten::abs': np.abs,
+    'aten::log1p': np.log1p,
+    'aten::mul': np.multiply,
+    'aten::sum': lambda x, dims, keepdim=False, dtype=None: x.sum(axis=tuple(dims), keepdims=keepdim),
+    'aten::max': lambda x, dim, keepdim=False: (x.max(axis=dim, keepdims=keepdim), x.argmax(axis=dim)),
+    'aten::cat': lambda xs, dim: np.concatenate(xs, axis=dim),
+    'aten::log_softmax': _log_softmax,
+    'aten::dropout': lambda x, p, training: x,
+    'aten::Int': int,
+    'prim::NumToTensor': np.asarray,
+    'prim::ListConstruct': lambda *xs: list(xs),
+    'prim::TupleConstruct': lambda *xs: tuple(xs),
+}
+
+
+class ExportedModel():
+    """
+    A network exported by pytorch/export.py: its frozen graph as a list of
+    ops on NumPy arrays. Has NNetWrapper's predict and predict_batch.
+    """
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.metadata = json.loads(str(data['metadata']))
+            program = json.loads(str(data['program']))
+            self.constants = {name: data[f'constants/{name}'] for name in program['arrays']}
+        self.constants.update(program['constants'])
+        self.nodes = program['nodes']
+        self.input = program['input']
+        self.output = program['output']
+
+    def predict_batch(self, boards):
+        values = dict(self.constants)
+        values[self.input] = np.asarray(boards, np.float32)
+        for node in self.nodes:
+            result = OPS[node['op']](*(values[name] for name in node['inputs']))
+            if len(node['outputs']) == 1:
+                result = (result,)
+            values.update(zip(node['outputs'], result))
+        log_pis, vs = values[self.output]
+        return np.exp(log_pis), vs.reshape(-1)
+
+    def predict(self, board):
+        pis, vs = self.predict_batch(board[np.newaxis])
+        return pis[0], vs[0]
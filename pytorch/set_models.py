@@ -0,0 +1,54 @@
+import logging
+
+import torch
+import torch.nn.functional as F
+from torch import nn as nn
+
+from Game import Game
+
+
+class Model(nn.Module):
+    """
+    DeepSets over the stones: every stone's column of the board goes through
+    the same small network, the results are summed and maxed per team, and
+    the two team summaries go through the policy and value heads.
+
+    The output doesn't depend on the order of a team's stones, so boards
+    that only differ by stone order need no extra training examples.
+    """
+
+    def __init__(self, game: Game, args):
+        super().__init__()
+        self.args = args
+        self.board_x, self.board_y = game.getBoardSize()
+        self.action_size = game.getActionSize()
+        self.team_size = self.board_y // 2
+        width = args.num_channels
+        logging.info(f"Creating set encoder {width} wide")
+
+        # Runs on every stone: (B, stones, board_x) -> (B, stones, width)
+        self.stone = nn.Sequential(
+            nn.Linear(self.board_x, width),
+            nn.ReLU(),
+            nn.Linear(width, width),
+            nn.ReLU(),
+        )
+        # Sum and max of each team's stones.
+        self.fc = nn.Linear(4 * width, 2 * width)
+        self.fc_pi = nn.Linear(2 * width, self.action_size)
+        self.fc_v = nn.Linear(2 * width, 1)
+
+        logging.info(f"Created set encoder model: %s", str(self))
+
+    def forward(self, s: torch.Tensor):
+        s = s.view(-1, self.board_x, self.board_y).transpose(1, 2)  # one row per stone
+        # Positions and distances run into the thousands of inches, flags are 0 or 1.
+        s = torch.sign(s) * torch.log1p(s.abs())
+        s = self.stone(s)
+        teams = s.view(-1, 2, self.team_size, s.size(-1))
+        s = torch.cat([teams.sum(dim=2), teams.max(dim=2).values], dim=2).flatten(1)
+        s = F.dropout(F.relu(self.fc(s)), p=self.args.dropout, training=self.training)
+
+        pi = self.fc_pi(s)
+        v = self.fc_v(s)
+        return F.log_softmax(pi, dim=1), torch.tanh(v)
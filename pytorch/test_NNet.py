@@ -0,0 +1,161 @@
+import json
+import os
+import subprocess
+import sys
+from unittest import mock
+
+import numpy as np
+import torch
+
+from curling import board as board_utils
+from curling import constants as c
+from curling import game
+from pytorch import NNet
+from pytorch.NNet import NNetWrapper
+
+
+def _boards(curl):
+    boards = np.array([curl.getInitBoard() for _ in range(3)])
+    board_utils.configure_hammer_2_scenario(boards[1])
+    board_utils.set_stone(boards[2], c.P1, 0, 10, 100)
+    return boards
+
+
+def test_predict_batch_matches_predict():
+    curl = game.CurlingGame()
+    nnet = NNetWrapper(curl)
+    boards = _boards(curl)
+
+    pis, vs = nnet.predict_batch(boards)
+    assert pis.shape == (3, curl.getActionSize()) and vs.shape == (3,)
+    np.testing.assert_allclose(pis.sum(axis=1), 1, rtol=1e-5)
+    for board, pi, v in zip(boards, pis, vs):
+        single_pi, single_v = nnet.predict(board)
+        np.testing.assert_allclose(single_pi, pi, rtol=1e-5, atol=1e-7)
+        np.testing.assert_allclose(single_v, v, rtol=1e-5, atol=1e-7)
+
+
+def test_checkpoint_keeps_predictions(tmp_path):
+    curl = game.CurlingGame()
+    nnet = NNetWrapper(curl)
+    boards = _boards(curl)
+    nnet.save_checkpoint(str(tmp_path), 'model.pth.tar')
+
+    loaded = NNetWrapper(curl)
+    loaded.load_checkpoint(str(tmp_path), 'model.pth.tar')
+    for expected, actual in zip(nnet.predict_batch(boards), loaded.predict_batch(boards)):
+        np.testing.assert_array_equal(expected, actual)
+
+
+@mock.patch.dict(NNet.args, model='set')
+def test_set_model_ignores_stone_order():
+    curl = game.CurlingGame()
+    nnet = NNetWrapper(curl)
+    boards = _boards(curl)
+    shuffled = boards[:, :, np.r_[np.random.permutation(8), 8 + np.random.permutation(8)]]
+
+    for expected, actual in zip(nnet.predict_batch(boards), nnet.predict_batch(shuffled)):
+        np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-5)  # float32 sums in another order
+    swapped_teams = boards[:, :, np.r_[8:16, 0:8]]
+    assert np.abs(nnet.predict_batch(swapped_teams)[0] - nnet.predict_batch(boards)[0]).max() > 1e-3
+
+
+@mock.patch.dict(NNet.args, model='set')
+def test_quantized_predictions_stay_close(tmp_path):
+    # The ann model is linear from end to end, so int8 rounding adds up over all of its layers into sharp logits.
+    torch.manual_seed(0)  # Some random initial weights give larger int8 errors than the tolerances.
+    curl = game.CurlingGame()
+    nnet = NNetWrapper(curl)
+    boards = _boards(curl)
+    pis, vs = nnet.predict_batch(boards)
+    nnet.save_checkpoint(str(tmp_path), 'model.pth.tar')
+
+    with mock.patch.dict(NNet.args, quantize=True):
+        quantized = NNetWrapper(curl)
+        quantized.load_checkpoint(str(tmp_path), 'model.pth.tar')
+    q_pis, q_vs = quantized.predict_batch(boards)
+    np.testing.assert_allclose(q_pis, pis, atol=1e-2)
+    np.testing.assert_allclose(q_vs, vs, atol=5e-2)
+
+    # The float network is what gets saved.
+    quantized.save_checkpoint(str(tmp_path), 'again.pth.tar')
+    nnet.load_checkpoint(str(tmp_path), 'again.pth.tar')
+    np.testing.assert_array_equal(nnet.predict_batch(boards)[0], pis)
+
+
+@mock.patch.dict(NNet.args, model='set')
+def test_exported_model_matches_wrapper(tmp_path):
+    from pytorch import export
+    from pytorch.runtime import ExportedModel
+
+    curl = game.CurlingGame()
+    nnet = NNetWrapper(curl)
+    boards = _boards(curl)
+    nnet.save_checkpoint(str(tmp_path), 'model.pth.tar')
+    out = str(tmp_path / 'best')
+    metadata = export.export(curl, str(tmp_path), 'model.pth.tar', out)
+    assert metadata['model'] == 'set'
+
+    exported = ExportedModel(out + '.npz')
+    assert exported.metadata == metadata
+    for expected, actual in zip(nnet.predict_batch(boards), exported.predict_batch(boards)):
+        np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-6)
+    pi, v = exported.predict(boards[1])
+    np.testing.assert_allclose(pi, nnet.predict(boards[1])[0], rtol=1e-4, atol=1e-6)
+
+    extra_files = {'metadata.json': ''}
+    scripted = torch.jit.load(out + '.pt', _extra_files=extra_files)
+    assert json.loads(extra_files['metadata.json']) == metadata
+    log_pis, vs = scripted(torch.from_numpy(boards.astype(np.float32)))
+    np.testing.assert_allclose(np.exp(log_pis.numpy()), exported.predict_batch(boards)[0], rtol=1e-4, atol=1e-6)
+
+
+@mock.patch.dict(NNet.args, model='cnn', layers=4, num_channels=16)
+def test_exported_cnn_matches_wrapper(tmp_path):
+    from pytorch import export
+    from pytorch.runtime import ExportedModel
+
+    curl = game.CurlingGame()
+    nnet = NNetWrapper(curl)
+    boards = _boards(curl)
+    nnet.save_checkpoint(str(tmp_path), 'model.pth.tar')
+    export.export(curl, str(tmp_path), 'model.pth.tar', str(tmp_path / 'best'))
+
+    exported = ExportedModel(str(tmp_path / 'best.npz'))
+    for expected, actual in zip(nnet.predict_batch(boards), exported.predict_batch(boards)):
+        np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-6)
+
+
+@mock.patch.dict(NNet.args, model='set')
+def test_export_without_freeze(tmp_path):
+    # torch 1.6, in requirements.txt, has no torch.jit.freeze.
+    from pytorch import export
+    from pytorch.runtime import ExportedModel
+
+    curl = game.CurlingGame()
+    nnet = NNetWrapper(curl)
+    boards = _boards(curl)
+    nnet.save_checkpoint(str(tmp_path), 'model.pth.tar')
+    with mock.patch.object(torch.jit, 'freeze', None):
+        export.export(curl, str(tmp_path), 'model.pth.tar', str(tmp_path / 'best'))
+
+    exported = ExportedModel(str(tmp_path / 'best.npz'))
+    for expected, actual in zip(nnet.predict_batch(boards), exported.predict_batch(boards)):
+        np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-6)
+
+
+def test_runtime_batch_norm_matches_torch():
+    # Frozen graphs usually fold batch norm into the layer before it, but not every torch version does.
+    from pytorch.runtime import OPS
+
+    rng = np.random.default_rng(0)
+    x, mean, weight, bias = (rng.normal(size=shape).astype(np.float32) for shape in ((5, 3, 4, 2), 3, 3, 3))
+    var = rng.uniform(0.5, 2, size=3).astype(np.float32)
+    expected = torch.nn.functional.batch_norm(*map(torch.from_numpy, (x, mean, var, weight, bias)), eps=1e-5)
+    actual = OPS['aten::batch_norm'](x, weight, bias, mean, var, False, 0.1, 1e-5, False)
+    np.testing.assert_allclose(actual, expected.numpy(), rtol=1e-5, atol=1e-6)
+
+
+def test_runtime_does_not_import_torch():
+    code = 'import sys, pytorch.runtime; assert "torch" not in sys.modules'
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
@@ -1,6 +1,13 @@
 from unittest import mock
 
-from Arena import Arena
+import numpy as np
+
+from Arena import Arena, ParallelArena, SPRT, randomOpenings
+from MCTS import MCTS
+from NeuralNet import NeuralNet
+from curling import constants as c
+from curling import game
+from utils import dotdict
 
 
 def test_play_games_cumulative_score():
@@ -11,3 +18,101 @@ def test_play_games_cumulative_score():
     p1_score, p2_score = arena.playGames(10, verbose=False)
     assert p1_score == 5
     assert p2_score == 25
+
+
+def test_play_games_stops_when_sprt_decides():
+    mock_game = mock.Mock()
+    # Players take turns starting: player2 wins every game.
+    mock_game.getGameEnded.side_effect = [-1, 1] * 10
+    arena = Arena(mock.Mock(), mock.Mock(), mock_game)
+    sprt = SPRT(0.51)
+    assert arena.playGames(20, sprt=sprt) == (0, 4)
+    assert arena.gamesPlayed == 4
+    assert sprt.decision() is True
+
+
+def test_sprt_skips_ties():
+    mock_game = mock.Mock()
+    # Ties first, which must not count as wins for player1, then player2 wins every game.
+    mock_game.getGameEnded.side_effect = [game._TIED_SCORE] * 10 + [-1, 1] * 10
+    arena = Arena(mock.Mock(), mock.Mock(), mock_game)
+    sprt = SPRT(0.51)
+    p1_score, p2_score = arena.playGames(30, sprt=sprt)
+    assert p1_score < 1 and 4 <= p2_score < 5
+    assert arena.gamesPlayed == 14
+    assert sprt.decision() is True
+
+
+def test_sprt_rejects_losses_and_waits_on_mixed_results():
+    sprt = SPRT(0.51)
+    for won in (True, False) * 10:
+        sprt.update(won)
+    assert sprt.decision() is None
+    for _ in range(4):
+        sprt.update(False)
+    assert sprt.decision() is False
+
+
+class ScriptedNet(NeuralNet):
+    """Puts almost all of the policy on the action named by the checkpoint's filename."""
+
+    def __init__(self, game):
+        super().__init__(game)
+        self.action_size = game.getActionSize()
+        self.action = None
+
+    def load_checkpoint(self, folder, filename):
+        self.action = int(filename)
+
+    def predict(self, board):
+        pi = np.full(self.action_size, 1e-3)
+        pi[self.action] = 1
+        return pi / pi.sum(), 0.0
+
+
+def test_parallel_arena_matches_arena():
+    curl = game.CurlingGame(physics='numpy', use_trajectories=True)
+    args = dotdict({'numMCTSSims': 2, 'cpuct': 1})
+    draw, button = c.ACTION_LIST.index((1, '3', -2)), c.ACTION_LIST.index((-1, '4', 1))
+
+    parallel = ParallelArena(curl, ScriptedNet, args, ('', str(draw)), ('', str(button)), workers=2)
+    scores = parallel.playGames(3)
+    assert [swapped for swapped, _ in parallel.results] == [False, False, True]
+
+    players = []
+    for action in (draw, button):
+        nnet = ScriptedNet(curl)
+        nnet.load_checkpoint('', str(action))
+        mcts = MCTS(curl, nnet, args)
+        players.append(lambda x, mcts=mcts: np.argmax(mcts.getActionProb(x, temp=0)))
+    # The second game replays the first one, so it isn't scored.
+    assert scores == Arena(players[0], players[1], curl).playGames(2)
+
+
+def test_parallel_arena_skips_replays():
+    curl = game.CurlingGame(physics='numpy', use_trajectories=True)
+    args = dotdict({'numMCTSSims': 2, 'cpuct': 1})
+    draw, button = c.ACTION_LIST.index((1, '3', -2)), c.ACTION_LIST.index((-1, '4', 1))
+
+    parallel = ParallelArena(curl, ScriptedNet, args, ('', str(draw)), ('', str(button)), workers=1)
+    scores = parallel.playGames(4)
+    # Without openings there are only two different games: one with each side starting.
+    assert parallel.replays == 2
+    assert parallel.results[0] == parallel.results[1] and parallel.results[2] == parallel.results[3]
+    assert sum(scores) == abs(parallel.results[0][1]) + abs(parallel.results[2][1])
+
+    sprt = SPRT(0.51)
+    with mock.patch.object(sprt, 'update', wraps=sprt.update) as update:
+        parallel.playGames(4, sprt=sprt)
+    assert update.call_count == 2
+
+
+def test_random_openings():
+    curl = game.CurlingGame(physics='numpy', use_trajectories=True)
+    openings = randomOpenings(curl, 3, 2, seed=1)
+    assert openings == randomOpenings(curl, 3, 2, seed=1)
+    assert len(set(openings)) == 3 and all(len(opening) == 2 for opening in openings)
+
+    board = curl.getInitBoard()
+    valids = curl.getValidMoves(board, 1)
+    assert all(valids[opening[0]] for opening in openings)
@@ -0,0 +1,125 @@
+import os
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from Coach import Coach, SelfPlayException
+from NeuralNet import NeuralNet
+from curling import game
+from utils import dotdict
+
+
+class UniformNet(NeuralNet):
+
+    def __init__(self, game):
+        super().__init__(game)
+        self.action_size = game.getActionSize()
+
+    def predict(self, board):
+        return np.ones(self.action_size) / self.action_size, 0.0
+
+    def save_checkpoint(self, folder, filename):
+        os.makedirs(folder, exist_ok=True)
+        open(os.path.join(folder, filename), 'w').close()
+
+    def load_checkpoint(self, folder, filename):
+        assert os.path.isfile(os.path.join(folder, filename))
+
+
+class DyingNet(UniformNet):
+    """Kills the self-play worker on its first prediction, like the OOM killer would."""
+
+    def predict(self, board):
+        os._exit(1)
+
+
+def _selfPlay(tmp_path, workers, inference_server=False):
+    curl = game.CurlingGame(physics='numpy', use_trajectories=True)
+    args = dotdict({
+        'numEps': 3, 'numSelfPlayWorkers': workers, 'seed': 7, 'numMCTSSims': 2, 'cpuct': 1, 'tempThreshold': 4,
+        'maxlenOfQueue': 10000, 'numItersForTrainExamplesHistory': 1, 'checkpoint': str(tmp_path),
+        'inferenceServer': inference_server,
+    })
+    examples, searched, _ = Coach(curl, UniformNet(curl), args).selfPlay()
+    return sorted(np.concatenate([np.ravel(board), pi, [v]]).tobytes() for board, pi, v in examples), searched
+
+
+def test_self_play_is_seeded(tmp_path):
+    assert _selfPlay(tmp_path, workers=1) == _selfPlay(tmp_path, workers=1)
+
+
+def test_self_play_workers_match_serial(tmp_path):
+    assert _selfPlay(tmp_path, workers=2) == _selfPlay(tmp_path, workers=1)
+    assert os.path.isfile(tmp_path / 'selfplay.pth.tar')
+
+
+def test_self_play_with_inference_server(tmp_path):
+    assert _selfPlay(tmp_path, workers=2, inference_server=True) == _selfPlay(tmp_path, workers=1)
+
+
+def test_learn_async(tmp_path):
+    curl = game.CurlingGame(physics='numpy', use_trajectories=True)
+    args = dotdict({
+        'numIters': 2, 'numEps': 2, 'numSelfPlayWorkers': 2, 'seed': 3, 'numMCTSSims': 2, 'cpuct': 1,
+        'tempThreshold': 4, 'maxlenOfQueue': 10000, 'numItersForTrainExamplesHistory': 20, 'arenaCompare': 2,
+        'updateThreshold': 0.5, 'checkpoint': str(tmp_path),
+    })
+    coach = Coach(curl, UniformNet(curl), args)
+    coach.nnet.train = mock.Mock()
+
+    busy = coach.learnAsync()
+
+    assert coach.nnet.train.call_count == 2
+    assert coach.trainExamplesHistory.iterations() == [1, 2]
+    assert all(examples > 0 for _, examples in coach.trainExamplesHistory.segments)
+    assert busy['self play'] > 0 and busy['training'] >= 0 and busy['arena'] > 0
+    assert os.path.isfile(tmp_path / 'checkpoint_2.pth.tar')
+
+
+def test_learn_async_raises_when_a_worker_dies(tmp_path):
+    curl = game.CurlingGame(physics='numpy', use_trajectories=True)
+    args = dotdict({
+        'numIters': 1, 'numEps': 2, 'numSelfPlayWorkers': 2, 'seed': 3, 'numMCTSSims': 2, 'cpuct': 1,
+        'tempThreshold': 4, 'maxlenOfQueue': 10000, 'numItersForTrainExamplesHistory': 1, 'checkpoint': str(tmp_path),
+    })
+    with pytest.raises(SelfPlayException):
+        Coach(curl, DyingNet(curl), args).learnAsync()
+
+
+def test_examples_saved_in_chunks(tmp_path):
+    curl = game.CurlingGame(physics='numpy')
+    args = dotdict({
+        'maxlenOfQueue': 100, 'numItersForTrainExamplesHistory': 2, 'checkpoint': str(tmp_path / 'run1'),
+        'load_folder_file': (str(tmp_path / 'run1'), 'checkpoint_3.pth.tar'),
+    })
+    coach = Coach(curl, UniformNet(curl), args)
+    board, pi = curl.getInitBoard(), np.ones(curl.getActionSize()) / curl.getActionSize()
+    for i in range(1, 4):
+        coach.addTrainExamples(i, [(board, pi, float(i))] * i)
+        coach.evictTrainExamples()
+        coach.saveTrainExamples(i)
+    # Every iteration is written once, whatever the history.
+    assert len(os.listdir(tmp_path / 'run1' / 'examples')) == 3 * 3
+    assert os.path.getsize(tmp_path / 'run1' / 'checkpoint_3.pth.tar.examples') < 1000
+
+    resumed = Coach(curl, UniformNet(curl), dotdict(args, checkpoint=str(tmp_path / 'run2')))
+    with mock.patch('numpy.load', wraps=np.load) as load:
+        resumed.loadTrainExamples()
+    assert load.call_count == 2 * 3  # The chunk of iteration 1 isn't read.
+    assert resumed.skipFirstSelfPlay
+    assert resumed.trainExamplesHistory.size == 0  # Still on disk.
+    assert [v for _, _, v in resumed.trainExamplesHistory] == [2, 2, 3, 3, 3]
+
+    resumed.saveTrainExamples(0)
+    args.load_folder_file = (str(tmp_path / 'run2'), 'checkpoint_0.pth.tar')
+    again = Coach(curl, UniformNet(curl), args)
+    again.loadTrainExamples()
+    assert [v for _, _, v in again.trainExamplesHistory] == [2, 2, 3, 3, 3]
+
+
+def test_self_play_leaves_global_random_state(tmp_path):
+    before = np.random.get_state()
+    _selfPlay(tmp_path, workers=1)
+    after = np.random.get_state()
+    assert after[2] == before[2] and (after[1] == before[1]).all()
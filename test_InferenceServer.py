@@ -0,0 +1,119 @@
+import threading
+
+import numpy as np
+import pytest
+
+from InferenceServer import InferenceServer, InferenceServerException
+from NeuralNet import NeuralNet
+from curling import game
+
+
+class BatchSizeNet(NeuralNet):
+    """
+    Policy is the board's first row, times the checkpoint's filename if it's a number. Value is the size of the batch
+    the board was evaluated in.
+    """
+
+    def __init__(self, game):
+        super().__init__(game)
+        self.action_size = game.getActionSize()
+        self.scale = 1
+
+    def load_checkpoint(self, folder, filename):
+        self.scale = float(filename or 1)
+
+    def predict_batch(self, boards):
+        pis = np.zeros((len(boards), self.action_size))
+        pis[:, :boards.shape[2]] = boards[:, 0] * self.scale
+        return pis, np.full(len(boards), len(boards))
+
+
+class ThreadsNet(BatchSizeNet):
+    """Value is the number of torch threads of the server's process."""
+
+    def predict_batch(self, boards):
+        import torch
+        pis, _ = super().predict_batch(boards)
+        return pis, np.full(len(boards), torch.get_num_threads())
+
+
+class BrokenNet(BatchSizeNet):
+    def predict_batch(self, boards):
+        raise ValueError('The server fails on the first request.')
+
+
+@pytest.fixture
+def curl():
+    return game.CurlingGame()
+
+
+def test_client_predicts_like_network(curl):
+    board = curl.getInitBoard()
+    board[0] = np.arange(16)
+    with InferenceServer(curl, BatchSizeNet, ('', ''), clients=1, max_boards=4) as server:
+        pi, v = server.clients[0].predict(board)
+        pis, vs = server.clients[0].predict_batch(np.stack([board, 2 * board, 3 * board]))
+
+    np.testing.assert_array_equal(pi[:16], np.arange(16))
+    assert v == 1
+    np.testing.assert_array_equal(pis[:, 1], [1, 2, 3])
+    np.testing.assert_array_equal(vs, [3, 3, 3])
+
+    with pytest.raises(ValueError):
+        server.clients[0].predict_batch(np.stack([board] * 5))
+
+
+def test_requests_are_batched(curl):
+    clients = 4
+    batch_sizes = [None] * clients
+    with InferenceServer(curl, BatchSizeNet, ('', ''), clients=clients, max_batch_size=clients, max_wait=5) as server:
+        def predict(i):
+            board = curl.getInitBoard()
+            board[0] = i
+            pi, batch_sizes[i] = server.clients[i].predict(board)
+            assert pi[0] == i
+
+        threads = [threading.Thread(target=predict, args=(i,)) for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # Waiting up to 5 seconds for max_batch_size boards puts all four in one batch.
+    assert batch_sizes == [clients] * clients
+
+
+def test_batches_stay_under_max_batch_size(curl):
+    batch_sizes = [None] * 2
+    with InferenceServer(curl, BatchSizeNet, ('', ''), clients=2, max_boards=3, max_batch_size=4, max_wait=1) as server:
+        def predict(i):
+            batch_sizes[i] = server.clients[i].predict_batch(np.stack([curl.getInitBoard()] * 3))[1][0]
+
+        threads = [threading.Thread(target=predict, args=(i,)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # Both requests together are 6 boards, over max_batch_size: they run one after the other.
+    assert batch_sizes == [3, 3]
+
+
+def test_server_threads(curl):
+    with InferenceServer(curl, ThreadsNet, ('', ''), clients=1, threads=2) as server:
+        assert server.clients[0].predict(curl.getInitBoard())[1] == 2
+
+
+def test_reload(curl):
+    board = curl.getInitBoard()
+    board[0] = 1
+    with InferenceServer(curl, BatchSizeNet, ('', ''), clients=1) as server:
+        assert server.clients[0].predict(board)[0][0] == 1
+        server.reload(('', '3'))
+        assert server.clients[0].predict(board)[0][0] == 3
+
+
+def test_client_raises_when_server_dies(curl):
+    with InferenceServer(curl, BrokenNet, ('', ''), clients=1) as server:
+        with pytest.raises(InferenceServerException):
+            server.clients[0].predict(curl.getInitBoard())
@@ -0,0 +1,204 @@
+import math
+import zlib
+from unittest import mock
+
+import numpy as np
+
+from MCTS import EPS, MCTS
+from curling import constants as c
+from curling import game
+from utils import dotdict
+
+
+class CountdownGame:
+    """Players take 1 or 2 from a counter of 5. Whoever takes the last one wins."""
+
+    def getBoardSize(self):
+        return (1,)
+
+    def getActionSize(self):
+        return 2
+
+    def getTransposition(self, board):
+        return board, np.arange(2)
+
+    def stateKey(self, board):
+        return board.tobytes()
+
+    def getNextState(self, board, player, action):
+        return np.maximum(board - action - 1, 0), -player
+
+    def getCanonicalForm(self, board, player):
+        return board
+
+    def getValidMoves(self, board, player):
+        return [1, int(board[0] >= 2)]
+
+    def getGameEnded(self, board, player):
+        return -1 if board[0] == 0 else 0
+
+
+class UniformNet:
+    def __init__(self, actions):
+        self.actions = actions
+        self.predict = mock.Mock(side_effect=lambda board: (np.ones(self.actions) / self.actions, 0.0))
+
+
+class SeededNet:
+    """Policy and value drawn from a generator seeded with the board, so every search sees the same net."""
+
+    def __init__(self, actions):
+        self.actions = actions
+
+    def predict(self, board):
+        rng = np.random.default_rng(zlib.crc32(np.ascontiguousarray(board).tobytes()))
+        return rng.dirichlet(np.ones(self.actions)), rng.uniform(-1, 1)
+
+
+class DictMCTS:
+    """The search MCTS replaced: nodes in dicts keyed by stringRepresentation, searched recursively."""
+
+    def __init__(self, game, nnet, args):
+        self.game, self.nnet, self.args = game, nnet, args
+        self.Qsa, self.Nsa, self.Ns, self.Ps, self.Es, self.Vs = {}, {}, {}, {}, {}, {}
+
+    def search(self, canonicalBoard):
+        s = self.game.stringRepresentation(canonicalBoard)
+        if s not in self.Es:
+            self.Es[s] = self.game.getGameEnded(canonicalBoard, 1)
+        if self.Es[s] != 0:
+            return -self.Es[s]
+
+        if s not in self.Ps:
+            Ps, v = self.nnet.predict(canonicalBoard)
+            self.Vs[s] = self.game.getValidMoves(canonicalBoard, 1)
+            self.Ps[s] = Ps * self.Vs[s] / np.sum(Ps * self.Vs[s])
+            self.Ns[s] = 0
+            return -v
+
+        best, a = -float('inf'), -1
+        for b in range(self.game.getActionSize()):
+            if self.Vs[s][b]:
+                if (s, b) in self.Qsa:
+                    u = self.Qsa[(s, b)] + self.args.cpuct * self.Ps[s][b] * math.sqrt(self.Ns[s]) / (
+                            1 + self.Nsa[(s, b)])
+                else:
+                    u = self.args.cpuct * self.Ps[s][b] * math.sqrt(self.Ns[s] + EPS)
+                if u > best:
+                    best, a = u, b
+        next_s, next_player = self.game.getNextState(canonicalBoard, 1, a)
+        v = self.search(self.game.getCanonicalForm(next_s, next_player))
+
+        if (s, a) in self.Qsa:
+            self.Qsa[(s, a)] = (self.Nsa[(s, a)] * self.Qsa[(s, a)] + v) / (self.Nsa[(s, a)] + 1)
+            self.Nsa[(s, a)] += 1
+        else:
+            self.Qsa[(s, a)] = v
+            self.Nsa[(s, a)] = 1
+        self.Ns[s] += 1
+        return -v
+
+
+def test_visit_counts_add_up():
+    mcts = MCTS(CountdownGame(), UniformNet(2), dotdict({'numMCTSSims': 200, 'cpuct': 1.0}))
+    mcts.getActionProb(np.array([5.]))
+
+    root = mcts.nodes[np.array([5.]).tobytes()]
+    assert mcts.Ns[root] == 199  # The first search only expands the root
+    assert mcts.Nsa[root].sum() == mcts.Ns[root]
+
+
+def test_finds_winning_move():
+    mcts = MCTS(CountdownGame(), UniformNet(2), dotdict({'numMCTSSims': 200, 'cpuct': 1.0}))
+    # From 5 taking 2 leaves 3, which loses for the opponent.
+    assert np.argmax(mcts.getActionProb(np.array([5.]), temp=0)) == 1
+    assert mcts.size <= 6
+
+
+def test_known_edges_skip_getNextState():
+    curl = game.CurlingGame(physics='numpy', use_trajectories=True)
+    net = UniformNet(curl.getActionSize())
+    mcts = MCTS(curl, net, dotdict({'numMCTSSims': 20, 'cpuct': 1.0}))
+    board = curl.getInitBoard()
+
+    with mock.patch.object(curl, 'getNextState', wraps=curl.getNextState) as spy:
+        for _ in range(2):
+            mcts.getActionProb(board)
+            # Once an edge is known the search follows it without simulating the shot again.
+            searched = [call for call in spy.call_args_list if call.kwargs.get('use_cache', True)]
+            assert len(searched) == (mcts.children >= 0).sum()
+            assert net.predict.call_count == mcts.expanded.sum()
+
+    np.testing.assert_array_equal(mcts.boards[0], board)
+    assert mcts.Nsa[0].sum() == 39
+    assert (mcts.Nsa[0][~mcts.Vs[0]] == 0).all()
+    assert mcts.Ps[0].shape == (len(c.ACTION_LIST),)
+
+
+def test_search_batch_evaluates_leaves_together():
+    net = UniformNet(2)
+    net.predict_batch = mock.Mock(side_effect=lambda boards: (np.ones((len(boards), 2)) / 2, np.zeros(len(boards))))
+    mcts = MCTS(CountdownGame(), net, dotdict({'numMCTSSims': 200, 'cpuct': 1.0, 'mctsBatchSize': 4}))
+
+    assert np.argmax(mcts.getActionProb(np.array([5.]), temp=0)) == 1
+    net.predict.assert_not_called()
+    assert max(len(call.args[0]) for call in net.predict_batch.call_args_list) > 1
+
+    root = mcts.nodes[np.array([5.]).tobytes()]
+    assert mcts.Nsa[root].sum() + 1 == 200
+    assert not mcts.VLsa.any() and not mcts.VLs.any()
+
+
+def test_prune_keeps_subtree():
+    mcts = MCTS(CountdownGame(), UniformNet(2), dotdict({'numMCTSSims': 100, 'cpuct': 1.0}))
+    mcts.getActionProb(np.array([5.]))
+    child = mcts.nodes[np.array([3.]).tobytes()]
+    visits, q = mcts.Nsa[child].copy(), mcts.Qsa[child].copy()
+
+    mcts.prune(np.array([3.]))
+    assert set(mcts.nodes) == {np.array([n]).tobytes() for n in (3., 2., 1., 0.)}
+    root = mcts.nodes[np.array([3.]).tobytes()]
+    np.testing.assert_array_equal(mcts.Nsa[root], visits)
+    np.testing.assert_array_equal(mcts.Qsa[root], q)
+    assert (mcts.children[:mcts.size] < mcts.size).all()
+    assert not mcts.Nsa[mcts.size:].any()
+
+    # Visits already under the new root count towards numMCTSSims.
+    predictions = mcts.nnet.predict.call_count
+    mcts.getActionProb(np.array([3.]))
+    assert mcts.Ns[root] + 1 == 100
+    assert mcts.nnet.predict.call_count == predictions
+
+    # Without a new prune the same root gets numMCTSSims new simulations, as in a serial Arena.
+    mcts.getActionProb(np.array([3.]))
+    assert mcts.Ns[root] + 1 == 200
+
+
+def test_prune_unknown_board_starts_over():
+    mcts = MCTS(CountdownGame(), UniformNet(2), dotdict({'numMCTSSims': 10, 'cpuct': 1.0}))
+    mcts.getActionProb(np.array([5.]))
+    mcts.prune(np.array([7.]))
+    assert mcts.size == 0 and not mcts.nodes
+
+
+def test_matches_dict_based_search():
+    curl = game.CurlingGame(physics='numpy', use_trajectories=True)
+    args = dotdict({'numMCTSSims': 60, 'cpuct': 1.0})
+    board = curl.getInitBoard()
+    net = SeededNet(curl.getActionSize())
+
+    mcts = MCTS(curl, net, args)
+    mcts.getActionProb(board)
+    expected = DictMCTS(curl, net, args)
+    for _ in range(args.numMCTSSims):
+        expected.search(board)
+
+    assert mcts.size == len(expected.Es)
+    assert mcts.expanded.sum() == len(expected.Ps)
+    assert mcts.Nsa[:mcts.size].sum() > args.numMCTSSims  # searched below the root's children
+    for s in range(mcts.size):
+        key = curl.stringRepresentation(mcts.boards[s])
+        visits = [expected.Nsa.get((key, a), 0) for a in range(curl.getActionSize())]
+        q = [expected.Qsa.get((key, a), 0) for a in range(curl.getActionSize())]
+        np.testing.assert_array_equal(mcts.Nsa[s], visits)
+        np.testing.assert_allclose(mcts.Qsa[s], q, atol=1e-12)
@@ -0,0 +1,84 @@
+import pickle
+
+import numpy as np
+
+from ReplayBuffer import ReplayBuffer
+
+
+def _examples(n, first=0):
+    """n examples whose board, pi and v all hold the example's number."""
+    return [(np.full((2, 3), i), np.full(4, i), float(i)) for i in range(first, first + n)]
+
+
+def test_evicts_oldest_iterations():
+    buffer = ReplayBuffer((2, 3), 4, capacity=10)
+    buffer.add(1, _examples(3))
+    buffer.add(2, _examples(3, 3))
+    buffer.add(2, _examples(1, 6))
+    buffer.add(3, _examples(2, 7))
+    assert list(buffer.segments) == [[1, 3], [2, 4], [3, 2]]
+
+    assert buffer.evict(2) == 3
+    assert buffer.iterations() == [2, 3]
+    assert [v for _, _, v in buffer] == [3, 4, 5, 6, 7, 8]
+
+
+def test_full_buffer_overwrites_oldest_examples():
+    buffer = ReplayBuffer((2, 3), 4, capacity=5)
+    buffer.add(1, _examples(3))
+    buffer.add(2, _examples(4, 3))
+    assert len(buffer) == 5
+    assert list(buffer.segments) == [[1, 1], [2, 4]]
+    board, pi, v = buffer[0]
+    assert v == 2 and (board == 2).all() and (pi == 2).all()
+    assert buffer[-1][2] == 6
+
+
+def test_sample_keeps_examples_together():
+    buffer = ReplayBuffer((2, 3), 4, capacity=5)
+    buffer.add(1, _examples(8))
+    boards, pis, vs = buffer.sample(32)
+    assert boards.shape == (32, 2, 3) and pis.shape == (32, 4) and vs.shape == (32,)
+    assert boards.dtype == pis.dtype == vs.dtype == np.float32
+    assert set(vs) <= {3, 4, 5, 6, 7}
+    assert (boards == vs[:, None, None]).all() and (pis == vs[:, None]).all()
+
+
+def test_pickles_only_examples_in_use():
+    buffer = ReplayBuffer((2, 3), 4, capacity=1000)
+    buffer.add(1, _examples(3))
+    data = pickle.dumps(buffer)
+    assert len(data) < 1000
+
+    loaded = pickle.loads(data)
+    assert loaded.capacity == 1000 and loaded.segments == buffer.segments
+    assert [v for _, _, v in loaded] == [0, 1, 2]
+    loaded.add(2, _examples(2, 3))
+    assert [v for _, _, v in loaded] == [0, 1, 2, 3, 4]
+
+
+def _chunk(folder, name, examples):
+    files = [str(folder / f'{name}.{part}.npy') for part in ('boards', 'pis', 'vs')]
+    for file, part in zip(files, zip(*examples)):
+        np.save(file, np.array(part, np.float32))
+    return files
+
+
+def test_chunks_stay_on_disk(tmp_path):
+    buffer = ReplayBuffer((2, 3), 4, capacity=6)
+    buffer.addChunk(-2, _chunk(tmp_path, 'a', _examples(3)))
+    buffer.addChunk(-1, _chunk(tmp_path, 'b', _examples(2, 3)))
+    assert len(buffer) == 5 and buffer.size == 0
+    assert all(isinstance(array, np.memmap) for maps in buffer._maps.values() for array in maps)
+
+    buffer.add(1, _examples(3, 5))  # overwrites the oldest chunk's first two examples
+    assert buffer.iterations() == [-2, -1, 1]
+    assert [v for _, _, v in buffer] == [2, 3, 4, 5, 6, 7]
+    boards, pis, vs = buffer.sample(64)
+    assert set(vs) == {2, 3, 4, 5, 6, 7}
+    assert (boards == vs[:, None, None]).all() and (pis == vs[:, None]).all()
+
+    assert buffer.evict(2) == 1
+    assert buffer.iterations() == [-1, 1] and len(buffer._maps) == 1
+    loaded = pickle.loads(pickle.dumps(buffer))
+    assert [v for _, _, v in loaded] == [3, 4, 5, 6, 7]